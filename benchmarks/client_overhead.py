@@ -0,0 +1,63 @@
+# Measure NetHttpClient per-request overhead without network, legacy and fast json encoding
+#   python benchmarks/client_overhead.py [--requests 20000] [--items 1000]
+import argparse
+import asyncio
+import datetime
+import time
+
+import httpx
+from fastapi.encoders import jsonable_encoder
+from yarl import URL
+
+from yacore.net.http import NetHttpClient
+from yacore.net.http.client import encode_json
+
+
+def make_payload(items: int) -> list[dict]:
+    now = datetime.datetime(2023, 1, 1)
+    return [{"id": i, "name": f"item-{i}", "price": i * 0.5, "created": now} for i in range(items)]
+
+
+def bench(call, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        call()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+async def bench_requests(payload, count: int, fast_json: bool) -> float:
+    # responses are made in-process, so only client side work is measured
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=b"{}"))
+    async with NetHttpClient("localhost", fast_json=fast_json, transport=transport) as client:
+        start = time.perf_counter()
+        for i in range(count):
+            await client.post(f"items/{i % 16}", json=payload)
+        return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--items", type=int, default=1000)
+    args = parser.parse_args()
+
+    base_url = URL("http://localhost:80")
+    client = NetHttpClient("localhost")
+    print("url, us per call")
+    print(f"  yarl join: {bench(lambda: str(base_url / 'items/1'), args.requests):.2f}")
+    print(f"  cached:    {bench(lambda: client.upstreams[0].url_for('items/1'), args.requests):.2f}")
+
+    for items in (1, args.items):
+        payload = make_payload(items)
+        rounds = max(1, args.requests // items)
+        print(f"body of {items} items, us per call")
+        legacy = bench(lambda: httpx.Request("POST", "http://x", json=jsonable_encoder(payload)), rounds)
+        print(f"  jsonable_encoder + httpx json: {legacy:.2f}")
+        print(f"  encode_json:                   {bench(lambda: encode_json(payload), rounds):.2f}")
+        for fast_json in (False, True):
+            overhead = asyncio.run(bench_requests(payload, rounds, fast_json))
+            print(f"  request, fast_json={fast_json!s:5}:      {overhead:.2f}")
+
+
+if __name__ == "__main__":
+    main()
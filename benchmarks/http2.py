@@ -0,0 +1,47 @@
+# Compare many small concurrent requests throughput over http/1.1 connection pool and single h2c connection
+#   python benchmarks/http2.py [--requests 5000] [--concurrency 64] [--max-connections 16]
+import argparse
+import asyncio
+
+import httpx
+from utils import free_port, throughput, wait_ready
+
+from yacore.net.http import NetHttpClient, NetHttpServer
+
+
+async def bench(count: int, concurrency: int, max_connections: int) -> dict[str, float]:
+    async def ping():
+        return {"ok": True}
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    results = {}
+    async with NetHttpServer("127.0.0.1", port, h2_max_concurrent_streams=concurrency) as server:
+        server.add_get("/ping", ping)
+        async with NetHttpClient("127.0.0.1", port) as client:
+            await wait_ready(client)
+        limits = httpx.Limits(max_connections=max_connections)
+        clients = {
+            "http/1.1": httpx.AsyncClient(base_url=base_url, limits=limits),
+            # prior knowledge h2c, all requests are multiplexed over one connection
+            "h2c": httpx.AsyncClient(base_url=base_url, http1=False, http2=True),
+        }
+        for name, client in clients.items():
+            async with client:
+                results[name] = await throughput(lambda: client.get("/ping"), count, concurrency)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--max-connections", type=int, default=16)
+    args = parser.parse_args()
+    results = asyncio.run(bench(args.requests, args.concurrency, args.max_connections))
+    for name, rps in results.items():
+        print(f"{name:>8}: {rps:10.0f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Compare stdlib json and FastJSONResponse rendering and http round-trip on large payloads
+#   python benchmarks/json_response.py [--items 10000] [--requests 200] [--concurrency 8]
+import argparse
+import asyncio
+import datetime
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from utils import free_port, throughput, wait_ready
+
+from yacore.net.http import FastJSONResponse, NetHttpClient, NetHttpServer
+from yacore.net.http.serialization import json_dumps
+
+
+def make_payload(items: int) -> list[dict]:
+    now = datetime.datetime(2023, 1, 1)
+    return [
+        {"id": i, "name": f"item-{i}", "price": i * 0.5, "tags": ["a", "b", "c"], "created": now}
+        for i in range(items)
+    ]
+
+
+def bench_render(render, rounds: int = 20) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        render()
+    return rounds / (time.perf_counter() - start)
+
+
+async def bench_http(payload, response_class, count: int, concurrency: int) -> dict[str, float]:
+    pre_serialized = json_dumps(jsonable_encoder(payload))
+
+    async def ping():
+        return {"ok": True}
+
+    async def items():
+        return payload
+
+    async def direct():
+        return FastJSONResponse(payload)
+
+    async def raw():
+        return FastJSONResponse(pre_serialized)
+
+    port = free_port()
+    async with NetHttpServer("127.0.0.1", port, default_response_class=response_class) as server:
+        server.add_get("/ping", ping)
+        server.add_get("/items", items)
+        server.add_get("/direct", direct)
+        server.add_get("/raw", raw)
+        async with NetHttpClient("127.0.0.1", port) as client:
+            await wait_ready(client)
+            suburls = ["items", "direct", "raw"] if response_class is FastJSONResponse else ["items"]
+            return {suburl: await throughput(lambda: client.get(suburl), count, concurrency) for suburl in suburls}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=10_000)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    payload = make_payload(args.items)
+    renders = {
+        "JSONResponse": lambda: JSONResponse(jsonable_encoder(payload)),
+        "FastJSONResponse": lambda: FastJSONResponse(jsonable_encoder(payload)),
+        # handler returns response itself, so fastapi skips jsonable_encoder
+        "FastJSONResponse direct": lambda: FastJSONResponse(payload),
+    }
+    for name, render in renders.items():
+        print(f"{name}: render {bench_render(render):.1f} ops/s")
+    for response_class in (JSONResponse, FastJSONResponse):
+        name = response_class.__name__
+        results = asyncio.run(bench_http(payload, response_class, args.requests, args.concurrency))
+        for suburl, rps in results.items():
+            print(f"{name}: http /{suburl} {rps:.0f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import asyncio
+import socket
+import time
+
+import httpx
+
+from yacore.net.http import NetHttpClient
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(client: NetHttpClient, suburl: str = "ping"):
+    # server binds socket in background task
+    for _ in range(100):
+        try:
+            return await client.get(suburl)
+        except httpx.TransportError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError("Server is not ready")
+
+
+async def throughput(call, count: int, concurrency: int) -> float:
+    queue = iter(range(count))
+
+    async def worker():
+        for _ in queue:
+            await call()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return count / (time.perf_counter() - start)
@@ -11,7 +11,11 @@ extras_require = {
     "db.postgresql": ["asyncpg", "yarl"],
     "log.loguru": ["loguru"],
     "log.std": ["pyyaml"],
-    "net.http": ["async-timeout", "fastapi >= 0.89.0", "httpx", "hypercorn", "yarl"],
+    "loop.uvloop": ["uvloop"],
+    "net.http": ["async-timeout", "fastapi >= 0.89.0", "httpx", "hypercorn", "orjson", "yarl"],
+    "net.http.compression": ["brotli", "zstandard"],
+    "net.http.http3": ["aioquic"],
+    "net.http.msgpack": ["msgpack"],
 }
 
 extras_dev = set()
@@ -29,6 +33,7 @@ setup(
     },
     python_requires=">= 3.11",
     install_requires=[
+        "click",
         "cock >= 0.11.0",
         "facet >= 0.9.1",
         "giveme",
@@ -6,7 +6,9 @@ from yacore.db.postgresql import DbPostgresql, db_postgresql_options
 from yacore.executors import executors_from_config, executors_options
 from yacore.injector import injector, register
 from yacore.log.loguru import configure_logging_from_config, log_options
+from yacore.loop import loop_options
 from yacore.net.http import NetHttpClient, net_http_server_from_config
+from yacore.net.http.client import net_http_client_options
 from yacore.net.http.server import net_http_options
 
 
@@ -16,6 +18,8 @@ def core_config(unused_tcp_port):
         db_postgresql_options,
         executors_options,
         log_options,
+        loop_options,
+        net_http_client_options,
         net_http_options,
     )
     cfg.update({
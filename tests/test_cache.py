@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from yacore.cache import AsyncCache
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_eviction():
+    cache = AsyncCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    cache.delete("a")
+    assert cache.get("a", "default") == "default"
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_ttl():
+    clock = Clock()
+    cache = AsyncCache(ttl=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=20)
+    cache.set("c", 3, ttl=None)
+    clock.now = 15
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    clock.now = 1000
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+@pytest.mark.asyncio
+async def test_get_or_compute_coalesce():
+    cache = AsyncCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    results = await asyncio.gather(*[cache.get_or_compute("key", compute) for _ in range(5)])
+    assert results == ["value"] * 5
+    assert await cache.get_or_compute("key", compute) == "value"
+    assert calls == [1]
+    assert (cache.hits, cache.misses, cache.coalesced) == (1, 1, 4)
+
+
+@pytest.mark.asyncio
+async def test_get_or_compute_error_not_cached():
+    cache = AsyncCache()
+
+    async def fail():
+        raise ZeroDivisionError
+
+    with pytest.raises(ZeroDivisionError):
+        await cache.get_or_compute("key", fail)
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_get_or_compute_leader_cancelled():
+    cache = AsyncCache()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        return "value"
+
+    leader = asyncio.ensure_future(cache.get_or_compute("key", compute))
+    follower = asyncio.ensure_future(cache.get_or_compute("key", compute))
+    await asyncio.sleep(0)
+    leader.cancel()
+    assert await follower == "value"
+    assert cache.get("key") == "value"
@@ -1,10 +1,26 @@
 import asyncio
+import itertools
 import math
+import os
 import time
 
 import pytest
+import pytest_asyncio
 
-from yacore.executors import blocking_cpu_function, blocking_io_function
+from yacore.executors import (
+    ExecutorDeadlineExceededError,
+    ExecutorPool,
+    ExecutorPoolAutoscaler,
+    ExecutorPoolOverloadedError,
+    Executors,
+    blocking_cpu_function,
+    blocking_io_function,
+    cached_blocking_cpu_function,
+    cached_blocking_io_function,
+    executors_from_config,
+)
+from yacore.injector import injector, register
+from yacore.metrics import InMemoryMetrics, default_metrics
 
 
 @pytest.mark.asyncio
@@ -45,3 +61,373 @@ async def test_cpu_decorator(executors):
     await asyncio.gather(sleep(0.1), sleep(0.1))
     delta = time.perf_counter() - start
     assert math.isclose(delta, 0.2, rel_tol=0.25)
+
+
+def _square(x):
+    return x * x
+
+
+@blocking_cpu_function
+def process_pid():
+    return os.getpid()
+
+
+def _set_worker_mark(value):
+    os.environ["YACORE_TEST_WORKER_MARK"] = value
+
+
+def _get_worker_mark():
+    return os.environ.get("YACORE_TEST_WORKER_MARK")
+
+
+@pytest_asyncio.fixture
+async def process_executors():
+    async with Executors(io_threads_count=2, cpu_threads_count=2, cpu_backend="process", cpu_prewarm=True,
+                         cpu_initializer=_set_worker_mark, cpu_initargs=("marked",)) as ex:
+        register(lambda: ex, name="executors")
+        yield ex
+        injector.delete("executors")
+
+
+@pytest.mark.asyncio
+async def test_cpu_process_backend(process_executors):
+    assert await process_executors.blocking_cpu_call(_square, 3) == 9
+    assert await process_executors.blocking_cpu_call(os.getpid) != os.getpid()
+    assert await process_executors.blocking_cpu_call(_get_worker_mark) == "marked"
+
+
+@pytest.mark.asyncio
+async def test_cpu_process_backend_decorator(process_executors):
+    assert await process_pid() != os.getpid()
+
+
+@pytest.mark.asyncio
+async def test_cpu_process_backend_not_picklable(process_executors):
+    square = blocking_cpu_function(lambda x: x * x)
+    with pytest.raises(TypeError):
+        await square(3)
+
+
+def test_cpu_backend_unknown():
+    with pytest.raises(ValueError):
+        Executors(io_threads_count=1, cpu_threads_count=1, cpu_backend="unknown")
+
+
+def _reverse(data):
+    assert isinstance(data, bytes)
+    return data[::-1]
+
+
+def _view_sum(view):
+    assert isinstance(view, memoryview)
+    return sum(view)
+
+
+@pytest_asyncio.fixture
+async def shared_memory_executors():
+    async with Executors(io_threads_count=1, cpu_threads_count=2, cpu_backend="process",
+                         cpu_shared_memory_threshold=1024) as ex:
+        yield ex
+
+
+@pytest.mark.asyncio
+async def test_cpu_process_shared_memory(shared_memory_executors):
+    data = os.urandom(1024 * 1024)
+    assert await shared_memory_executors.blocking_cpu_call(_reverse, data) == data[::-1]
+    assert await shared_memory_executors.blocking_cpu_call(_reverse, b"small") == b"llams"
+    array = memoryview(bytearray(range(256)) * 16).cast("H")
+    assert await shared_memory_executors.blocking_cpu_call(_view_sum, view=array) == sum(array)
+    result = await shared_memory_executors.blocking_cpu_call(bytearray, data)
+    assert isinstance(result, bytearray) and result == data
+    assert shared_memory_executors.shared_memory.free_segments_count == 2
+
+
+@pytest.mark.asyncio
+async def test_cpu_process_shared_memory_numpy(shared_memory_executors):
+    numpy = pytest.importorskip("numpy")
+    array = numpy.arange(100_000, dtype=numpy.float64).reshape(1000, 100)
+    result = await shared_memory_executors.blocking_cpu_call(numpy.transpose, array)
+    assert result.shape == (100, 1000)
+    assert numpy.array_equal(result, array.T)
+
+
+@pytest.mark.asyncio
+async def test_cpu_process_shared_memory_offload_copy(shared_memory_executors):
+    shared_memory_executors.shared_memory.offload_size = 4096
+    data = os.urandom(64 * 1024)
+    assert await shared_memory_executors.blocking_cpu_call(_reverse, data) == data[::-1]
+    result = await shared_memory_executors.blocking_cpu_call(bytearray, bytearray(data))
+    assert isinstance(result, bytearray) and result == data
+    array = memoryview(bytearray(data)).cast("H")
+    assert await shared_memory_executors.blocking_cpu_call(_view_sum, view=array) == sum(array)
+    result = await shared_memory_executors.blocking_cpu_call(memoryview, array)
+    assert result.format == "H" and result.tolist() == array.tolist()
+    assert shared_memory_executors.shared_memory.free_segments_count == 1
+
+
+@pytest.mark.asyncio
+async def test_map_io_ordered(executors):
+    results = [x async for x in executors.map_io(pow, range(100), itertools.repeat(2), chunk_size=7)]
+    assert results == [x ** 2 for x in range(100)]
+
+
+@pytest.mark.asyncio
+async def test_map_cpu_unordered(process_executors):
+    results = [x async for x in process_executors.map_cpu(_square, range(100), chunk_size=10, ordered=False)]
+    assert sorted(results) == [x * x for x in range(100)]
+
+
+@pytest.mark.asyncio
+async def test_map_window(executors):
+    submitted = []
+
+    def sleep(x):
+        submitted.append(x)
+        time.sleep(0.05)
+        return x
+
+    mapped = executors.map_io(sleep, range(100), chunk_size=1, window=2)
+    assert await anext(mapped) == 0
+    assert len(submitted) <= 3
+    await mapped.aclose()
+
+
+@pytest.mark.asyncio
+async def test_map_decorator(executors):
+    square = blocking_cpu_function(_square)
+    io_square = blocking_io_function(_square)
+    assert [x async for x in square.map(range(10))] == [x * x for x in range(10)]
+    assert [x async for x in io_square.map(range(10), chunk_size=3)] == [x * x for x in range(10)]
+
+
+@pytest_asyncio.fixture
+async def pooled_executors(core_config):
+    core_config["executors_pools"] = ("slow:thread:1:1", "render:process:1")
+    async with executors_from_config() as ex:
+        register(lambda: ex, name="executors")
+        yield ex
+        injector.delete("executors")
+
+
+@pytest.mark.asyncio
+async def test_named_pool_isolation(pooled_executors):
+    slow = asyncio.ensure_future(pooled_executors.call("slow", time.sleep, 0.2))
+    start = time.perf_counter()
+    await pooled_executors.blocking_io_call(time.sleep, 0.01)
+    assert time.perf_counter() - start < 0.1
+    await slow
+
+
+@pytest.mark.asyncio
+async def test_named_pool_overloaded(pooled_executors):
+    calls = [asyncio.ensure_future(pooled_executors.call("slow", time.sleep, 0.05)) for _ in range(2)]
+    await asyncio.sleep(0)
+    with pytest.raises(ExecutorPoolOverloadedError):
+        await pooled_executors.call("slow", time.sleep, 0.05)
+    await asyncio.gather(*calls)
+
+
+@pytest.mark.asyncio
+async def test_named_pool_decorator(pooled_executors):
+    pid = blocking_io_function(os.getpid, pool="render")
+    assert await pid() != os.getpid()
+    with pytest.raises(ValueError):
+        await pooled_executors.call("unknown", os.getpid)
+
+
+def test_named_pool_duplicate():
+    with pytest.raises(ValueError):
+        Executors(io_threads_count=1, cpu_threads_count=1, pools=[ExecutorPool("io")])
+
+
+@pytest.mark.asyncio
+async def test_pool_admission_wait():
+    pool = ExecutorPool("wait", size=1, max_queue=1, admission="wait")
+    await pool.start()
+    try:
+        calls = [asyncio.ensure_future(pool.call(time.sleep, 0.05)) for _ in range(4)]
+        await asyncio.sleep(0)
+        assert pool.running == 1 and pool.queued == 1
+        await asyncio.gather(*calls)
+        assert pool.pending == 0
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_pool_admission_wait_after_expired_ticket():
+    pool = ExecutorPool("wait", size=1, max_queue=1, admission="wait")
+    await pool.start()
+    try:
+        # worker is busy, one call is queued and another one waits for queue space
+        pool.running = 1
+        expired = asyncio.ensure_future(pool.submit(time.sleep, (0,), deadline=pool.loop.time() + 10))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(pool.call(time.sleep, 0))
+        await asyncio.sleep(0)
+        priority, counter, ticket, _ = pool._queue[0]
+        pool._queue[0] = priority, counter, ticket, pool.loop.time() - 1
+        # dispatch drops expired ticket and wakes waiting call, which should get the free worker
+        pool._release()
+        with pytest.raises(ExecutorDeadlineExceededError):
+            await expired
+        await asyncio.wait_for(waiting, 1)
+        assert (pool.running, pool.queued) == (0, 0)
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_pool_deadline(executors):
+    blocker = asyncio.ensure_future(executors.call("cpu", time.sleep, 0.1))
+    await asyncio.sleep(0)
+    executed = []
+    deadline = executors.loop.time() + 0.05
+    start = time.perf_counter()
+    with pytest.raises(ExecutorDeadlineExceededError):
+        await executors.submit("cpu", executed.append, (1,), deadline=deadline)
+    assert time.perf_counter() - start < 0.09
+    await blocker
+    assert executed == []
+    pool = executors.get_pool("cpu")
+    assert (pool.running, pool.queued) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_pool_priority(executors):
+    order = []
+    blocker = asyncio.ensure_future(executors.call("cpu", time.sleep, 0.05))
+    await asyncio.sleep(0)
+    calls = [
+        asyncio.ensure_future(executors.submit("cpu", order.append, (name,), priority=priority))
+        for name, priority in [("low", 10), ("normal", 0), ("high", -10), ("normal2", 0)]
+    ]
+    await asyncio.gather(blocker, *calls)
+    assert order == ["high", "normal", "normal2", "low"]
+
+
+@pytest.mark.asyncio
+async def test_pool_cancelled_in_queue(executors):
+    blocker = asyncio.ensure_future(executors.call("cpu", time.sleep, 0.05))
+    await asyncio.sleep(0)
+    executed = []
+    queued = asyncio.ensure_future(executors.call("cpu", executed.append, 1))
+    await asyncio.sleep(0)
+    queued.cancel()
+    await blocker
+    assert await executors.call("cpu", executed.append, 2) is None
+    assert executed == [2]
+    assert executors.get_pool("cpu").pending == 0
+
+
+@pytest.mark.asyncio
+async def test_metrics(core_config):
+    metrics = InMemoryMetrics()
+    register(lambda: metrics, name="metrics")
+    try:
+        async with executors_from_config() as ex:
+            register(lambda: ex, name="executors")
+            square = blocking_io_function(_square)
+            assert await square(2) == 4
+            assert [x async for x in square.map(range(3))] == [0, 1, 4]
+            await ex.blocking_io_call(time.sleep, 0.01)
+            injector.delete("executors")
+    finally:
+        register(default_metrics, name="metrics", singleton=True)
+    label = dict(pool="io", function="_square")
+    assert metrics.histogram("yacore_executor_queue_wait_seconds", **label).count == 2
+    assert metrics.histogram("yacore_executor_run_seconds", **label).count == 2
+    assert metrics.gauge("yacore_executor_in_flight", **label) == 0
+    assert metrics.histogram("yacore_executor_run_seconds", pool="io", function="sleep").sum >= 0.01
+
+
+@pytest.mark.asyncio
+async def test_metrics_rejections():
+    metrics = InMemoryMetrics()
+    pool = ExecutorPool("tiny", size=1, max_queue=0, metrics=metrics)
+    await pool.start()
+    try:
+        blocker = asyncio.ensure_future(pool.call(time.sleep, 0.05))
+        await asyncio.sleep(0)
+        with pytest.raises(ExecutorPoolOverloadedError):
+            await pool.call(time.sleep, 0)
+        await blocker
+    finally:
+        pool.shutdown()
+    assert metrics.counter("yacore_executor_rejections_total", pool="tiny", function="sleep", reason="overloaded") == 1
+
+
+@pytest.mark.asyncio
+async def test_pool_resize():
+    pool = ExecutorPool("elastic", size=1, max_size=4)
+    await pool.start()
+    try:
+        start = time.perf_counter()
+        calls = [asyncio.ensure_future(pool.call(time.sleep, 0.05)) for _ in range(4)]
+        await asyncio.sleep(0)
+        pool.resize(4)
+        await asyncio.gather(*calls)
+        assert time.perf_counter() - start < 0.15
+        pool.resize(2)
+        await asyncio.gather(*[pool.call(time.sleep, 0.01) for _ in range(4)])
+        with pytest.raises(ValueError):
+            pool.resize(5)
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_autoscaler_decide():
+    resizes = []
+    pool = ExecutorPool("elastic", size=2, max_size=8)
+    autoscaler = ExecutorPoolAutoscaler(pool, 2, 8, shrink_intervals=2,
+                                        on_resize=lambda pool, old, new: resizes.append((old, new)))
+    await pool.start()
+    try:
+        calls = [asyncio.ensure_future(pool.call(time.sleep, 0.05)) for _ in range(6)]
+        await asyncio.sleep(0.01)
+        autoscaler.step(0.01)
+        assert pool.size == 3
+        autoscaler.step(0.01)
+        assert pool.size == 4
+        await asyncio.gather(*calls)
+        # drop queue waits of calls above
+        pool.take_stats()
+        autoscaler.step(1)
+        assert pool.size == 4
+        autoscaler.step(1)
+        assert pool.size == 3
+        assert resizes == [(2, 3), (3, 4), (4, 3)]
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_io_autoscale_from_config(core_config):
+    core_config.update(executors_io_autoscale=True, executors_io_threads_min=1, executors_io_autoscale_interval=0.01)
+    async with executors_from_config() as ex:
+        assert ex.get_pool("io").size == 1
+        await asyncio.gather(*[ex.blocking_io_call(time.sleep, 0.05) for _ in range(4)])
+        assert ex.get_pool("io").size == 2
+
+
+@pytest.mark.asyncio
+async def test_cached_decorator(executors):
+    calls = []
+
+    @cached_blocking_io_function(maxsize=2)
+    def lookup(x, *, scale=1):
+        calls.append(x)
+        time.sleep(0.01)
+        return x * scale
+
+    results = await asyncio.gather(*[lookup(i % 2, scale=2) for i in range(10)])
+    assert results == [0, 2] * 5
+    assert sorted(calls) == [0, 1]
+    assert await lookup(1, scale=2) == 2
+    assert await lookup(1) == 1
+    assert (lookup.cache.hits, lookup.cache.misses, lookup.cache.coalesced) == (1, 3, 8)
+
+    square = cached_blocking_cpu_function(_square, key=lambda x: x % 10)
+    assert await square(3) == 9
+    assert await square(13) == 9
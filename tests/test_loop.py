@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+
+from yacore.loop import install_event_loop, install_event_loop_from_config
+
+
+def _loop_module():
+    async def get():
+        return type(asyncio.get_running_loop()).__module__
+
+    return asyncio.run(get())
+
+
+def test_install_uvloop(core_config):
+    pytest.importorskip("uvloop")
+    core_config["loop"] = "uvloop"
+    try:
+        install_event_loop_from_config()
+        assert _loop_module().startswith("uvloop")
+    finally:
+        install_event_loop("asyncio")
+    assert _loop_module().startswith("asyncio")
+
+
+def test_install_unknown():
+    with pytest.raises(ValueError):
+        install_event_loop("unknown")
@@ -0,0 +1,49 @@
+import math
+
+from yacore.metrics import Histogram, InMemoryMetrics, PrometheusMetrics
+
+
+def test_histogram():
+    histogram = Histogram([0.1, 1])
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+    assert histogram.buckets == (0.1, 1, math.inf)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert math.isclose(histogram.sum, 5.65)
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1
+    assert histogram.quantile(1) == math.inf
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_in_memory_metrics():
+    metrics = InMemoryMetrics()
+    metrics.observe("latency", 0.2, route="/a")
+    metrics.observe("latency", 0.3, route="/a")
+    metrics.increment("requests", route="/a")
+    metrics.increment("requests", 2, route="/a")
+    metrics.set("in_flight", 3)
+    assert metrics.histogram("latency", route="/a").count == 2
+    assert metrics.histogram("latency", route="/b") is None
+    assert metrics.counter("requests", route="/a") == 3
+    assert metrics.counter("requests", route="/b") == 0
+    assert metrics.gauge("in_flight") == 3
+
+
+def test_prometheus_metrics():
+    metrics = PrometheusMetrics(buckets=[0.5])
+    metrics.observe("latency_seconds", 0.2, route='/"a"')
+    metrics.increment("requests_total", route="/a")
+    metrics.set("in_flight", 1)
+    assert metrics.render().splitlines() == [
+        "# TYPE requests_total counter",
+        'requests_total{route="/a"} 1',
+        "# TYPE in_flight gauge",
+        "in_flight 1",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/\\"a\\"",le="0.5"} 1',
+        'latency_seconds_bucket{route="/\\"a\\"",le="+Inf"} 1',
+        'latency_seconds_sum{route="/\\"a\\""} 0.2',
+        'latency_seconds_count{route="/\\"a\\""} 1',
+    ]
@@ -1,8 +1,39 @@
+import asyncio
+import datetime
+import functools
+import json
+import multiprocessing
+import os
+import signal
+import time
+
+import httpx
+import msgpack
 import pytest
-from fastapi import Body, HTTPException
+from fastapi import Body, Depends, HTTPException
 from httpx import HTTPStatusError
+from pydantic import BaseModel
+from starlette.requests import Request
+from starlette.responses import Response
 
-from yacore.net.http import NetHttpServer
+from yacore.injector import register
+from yacore.metrics import PrometheusMetrics, default_metrics
+from yacore.net.http import (
+    FastJSONResponse,
+    NetHttpClient,
+    NetHttpServer,
+    WorkersSupervisor,
+    net_http_server_from_config,
+    serialization,
+)
+from yacore.net.http.breaker import CircuitBreaker, CircuitOpenError
+from yacore.net.http.caching import HttpCache
+from yacore.net.http.client import net_http_client_from_config, net_http_clients_from_config
+from yacore.net.http.compression import CompressionMiddleware, parse_compression_levels
+from yacore.net.http.fanout import AdaptiveLimit
+from yacore.net.http.limits import ConcurrencyLimiter, ConcurrencyLimitExceededError
+from yacore.net.http.retry import HedgePolicy, RetryBudget, RetryPolicy
+from yacore.net.http.streaming import decode_json_array, decode_ndjson, stream_response
 
 
 @pytest.mark.asyncio
@@ -131,3 +162,923 @@ async def test_handler_unpack_json(web_client, web_server: NetHttpServer):
 
     response = await web_client.post("handle", json={"value": "error"}, raw=True)
     assert response.status_code == 500
+
+
+@pytest.mark.asyncio
+async def test_handler_fast_json_response(web_client, web_server: NetHttpServer):
+    async def handler():
+        return {"date": datetime.date(2023, 1, 2), "items": [1, 2, 3]}
+
+    async def raw():
+        return FastJSONResponse(b'{"pre":"serialized"}')
+
+    web_server.add_get("/handle", handler)
+    web_server.add_get("/raw", raw)
+    response = await web_client.get("handle")
+    assert response.headers["content-type"] == "application/json"
+    assert response.content == b'{"date":"2023-01-02","items":[1,2,3]}'
+    response = await web_client.get("raw")
+    assert response.json() == {"pre": "serialized"}
+
+
+def test_fast_json_response_fallback(monkeypatch):
+    class Model(BaseModel):
+        value: int
+
+    content = {"model": Model(value=1), "text": "привет"}
+    expected = FastJSONResponse(content).body
+    monkeypatch.setattr(serialization, "orjson", None)
+    assert FastJSONResponse(content).body == expected == '{"model":{"value":1},"text":"привет"}'.encode()
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+@pytest.mark.asyncio
+async def test_handler_json_stdlib_compatibility(use_orjson, monkeypatch, web_client, web_server: NetHttpServer):
+    async def keys():
+        return {1: "a", None: "b"}
+
+    async def values():
+        return {"big": 2 ** 70, "nan": float("nan"), "items": [float("inf"), 1.5]}
+
+    if not use_orjson:
+        monkeypatch.setattr(serialization, "orjson", None)
+    web_server.add_get("/keys", keys)
+    web_server.add_get("/values", values)
+    response = await web_client.get("keys")
+    assert response.json() == {"1": "a", "null": "b"}
+    response = await web_client.get("values")
+    assert response.json() == {"big": 2 ** 70, "nan": None, "items": [None, 1.5]}
+
+
+@pytest.mark.asyncio
+async def test_handler_response_cache(web_client, web_server: NetHttpServer):
+    calls = []
+
+    async def handler(value: int = 0):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        if value < 0:
+            raise HTTPException(status_code=404)
+        return {"value": value}
+
+    web_server.add_get("/handle", handler, cache_ttl=60)
+    responses = await asyncio.gather(*[web_client.get("handle", params={"value": 1}) for _ in range(5)])
+    assert calls == [1]
+    etags = {response.headers["etag"] for response in responses}
+    assert len(etags) == 1
+    assert {response.content for response in responses} == {b'{"value":1}'}
+
+    response = await web_client.get("handle", params={"value": 1}, headers={"if-none-match": etags.pop()})
+    assert response.status_code == 304
+    assert response.content == b""
+    response = await web_client.get("handle", params={"value": 2})
+    assert response.json() == {"value": 2}
+    assert calls == [1, 2]
+
+    for _ in range(2):
+        response = await web_client.get("handle", params={"value": -1})
+        assert response.status_code == 404
+    assert calls == [1, 2, -1, -1]
+
+
+@pytest.mark.asyncio
+async def test_handler_response_cache_key_and_ttl(web_client, web_server: NetHttpServer):
+    calls = []
+
+    async def handler(value: int = 0):
+        calls.append(value)
+        return value
+
+    web_server.add_get("/handle", handler, cache_ttl=0.1, cache_key=lambda request: None)
+    assert (await web_client.get("handle", params={"value": 1})).json() == 1
+    assert (await web_client.get("handle", params={"value": 2})).json() == 1
+    await asyncio.sleep(0.15)
+    assert (await web_client.get("handle", params={"value": 2})).json() == 2
+    assert calls == [1, 2]
+    with pytest.raises(ValueError):
+        web_server.add_get("/other", handler, cache_key=lambda request: None)
+
+
+@pytest.mark.asyncio
+async def test_handler_response_cache_path_params(web_client, web_server: NetHttpServer):
+    calls = []
+
+    async def item(id: int):
+        calls.append(id)
+        return {"id": id}
+
+    def authorize():
+        pass
+
+    web_server.add_get("/items/{id}", item, cache_ttl=60)
+    assert (await web_client.get("items/1")).json() == {"id": 1}
+    assert (await web_client.get("items/2")).json() == {"id": 2}
+    assert (await web_client.get("items/1")).json() == {"id": 1}
+    assert calls == [1, 2]
+    # cache hits would skip dependencies
+    with pytest.raises(ValueError, match="dependencies"):
+        web_server.add_get("/private", item, cache_ttl=60, dependencies=[Depends(authorize)])
+
+
+@pytest.mark.asyncio
+async def test_handler_response_cache_uncacheable(web_client, web_server: NetHttpServer):
+    calls = []
+
+    async def items():
+        for i in range(3):
+            await asyncio.sleep(0.01)
+            yield {"i": i}
+
+    async def stream():
+        calls.append("stream")
+        await asyncio.sleep(0.05)
+        return stream_response(items())
+
+    async def created():
+        calls.append("created")
+        await asyncio.sleep(0.05)
+        return Response(b"created", status_code=201)
+
+    web_server.add_get("/stream", stream, cache_ttl=60)
+    web_server.add_get("/created", created, cache_ttl=60)
+    # concurrent misses of uncacheable response are not coalesced, since response can be sent once
+    responses = await asyncio.gather(*[web_client.get("stream") for _ in range(3)])
+    assert [response.text for response in responses] == ['{"i":0}\n{"i":1}\n{"i":2}\n'] * 3
+    responses = await asyncio.gather(*[web_client.get("created") for _ in range(3)])
+    assert [(response.status_code, response.content) for response in responses] == [(201, b"created")] * 3
+    assert sorted(calls) == ["created"] * 3 + ["stream"] * 3
+    with pytest.raises(ValueError, match="response cache"):
+        web_server.add_stream_get("/items", items, cache_ttl=60)
+
+
+@pytest.fixture
+def metrics(core_config):
+    core_config.update({"net_http_enable_metrics": True})
+    metrics = PrometheusMetrics()
+    register(lambda: metrics, name="metrics")
+    yield metrics
+    register(default_metrics, name="metrics", singleton=True)
+
+
+@pytest.mark.asyncio
+async def test_server_metrics(metrics, web_client, web_server: NetHttpServer):
+    async def handler(item_id: int):
+        if item_id < 0:
+            raise ZeroDivisionError
+        return {"id": item_id}
+
+    web_server.add_get("/items/{item_id}", handler)
+    for item_id in (1, 2, -1):
+        await web_client.get(f"items/{item_id}")
+    await web_client.get("missing")
+    response = await web_client.get("metrics")
+    route = "/items/{item_id}"
+    assert metrics.counter("yacore_http_requests_total", method="GET", route=route, status=200) == 2
+    assert metrics.counter("yacore_http_requests_total", method="GET", route=route, status=500) == 1
+    assert metrics.counter("yacore_http_requests_total", method="GET", route="<unmatched>", status=404) == 1
+    assert metrics.histogram("yacore_http_request_duration_seconds", method="GET", route=route).count == 3
+    assert metrics.counter("yacore_http_response_size_bytes_total", method="GET", route=route) > 0
+    assert metrics.gauge("yacore_http_requests_in_flight") is not None
+    assert response.headers["content-type"] == PrometheusMetrics.content_type
+    assert 'yacore_http_requests_total{method="GET",route="/items/{item_id}",status="200"} 2' in response.text
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limiter():
+    limiter = ConcurrencyLimiter(1, max_queue=1, queue_timeout=0.05)
+    await limiter.acquire()
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    assert limiter.queued == 1
+    with pytest.raises(ConcurrencyLimitExceededError) as exc_info:
+        await limiter.acquire()
+    assert exc_info.value.reason == "queue_full"
+    limiter.release()
+    await waiter
+    assert (limiter.running, limiter.queued) == (1, 0)
+    with pytest.raises(ConcurrencyLimitExceededError) as exc_info:
+        await limiter.acquire()
+    assert exc_info.value.reason == "queue_timeout"
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    limiter.release()
+    assert (limiter.running, limiter.queued) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limiter_cancel_before_release():
+    limiter = ConcurrencyLimiter(1, max_queue=1)
+    await limiter.acquire()
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    # release drops cancelled waiter before the task resumes
+    waiter.cancel()
+    limiter.release()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert (limiter.running, limiter.queued) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_handler_concurrency_limit(metrics, web_client, web_server: NetHttpServer):
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def handler():
+        started.set()
+        await release.wait()
+        return "done"
+
+    web_server.add_get("/handle", handler, concurrency_limit=1, concurrency_retry_after=5)
+    first = asyncio.create_task(web_client.get("handle"))
+    await started.wait()
+    response = await web_client.get("handle")
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "5"
+    assert response.json()["code"] == "common.overloaded"
+    assert response.json()["data"] == {"reason": "queue_full"}
+    assert metrics.counter("yacore_http_shed_total", limiter="/handle", reason="queue_full") == 1
+    release.set()
+    assert (await first).json() == "done"
+
+
+@pytest.mark.asyncio
+async def test_handler_concurrency_limit_streaming(web_client, web_server: NetHttpServer):
+    running = peak = 0
+
+    async def items():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        try:
+            for i in range(3):
+                await asyncio.sleep(0.01)
+                yield i
+        finally:
+            running -= 1
+
+    # slot is held until streamed body is sent, not only until handler returns
+    web_server.add_stream_get("/items", items, concurrency_limit=1, concurrency_max_queue=3)
+    responses = await asyncio.gather(*[web_client.get("items") for _ in range(4)])
+    assert [response.text for response in responses] == ["0\n1\n2\n"] * 4
+    assert peak == 1
+
+
+@pytest.fixture
+def concurrency_limit(core_config):
+    core_config.update({
+        "net_http_concurrency_limit": 1,
+        "net_http_concurrency_max_queue": 1,
+        "net_http_concurrency_queue_timeout": 0.05,
+    })
+
+
+@pytest.mark.asyncio
+async def test_server_concurrency_limit(concurrency_limit, web_client, web_server: NetHttpServer):
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def handler():
+        started.set()
+        await release.wait()
+
+    web_server.add_get("/handle", handler)
+    first = asyncio.create_task(web_client.get("handle"))
+    await started.wait()
+    response = await web_client.get("handle")
+    assert response.status_code == 503
+    assert response.json()["data"] == {"reason": "queue_timeout"}
+    response = await web_client.get("healthcheck")
+    assert response.status_code == 200
+    release.set()
+    assert (await first).status_code == 200
+
+
+def test_compression_negotiation():
+    middleware = CompressionMiddleware(None, levels={"application/json": {"gzip": 9}})
+    assert middleware.negotiate("gzip, br;q=0.5") == "gzip"
+    assert middleware.negotiate("gzip;q=0.1, zstd") == "zstd"
+    assert middleware.negotiate("*") == "zstd"
+    assert middleware.negotiate("gzip;q=0, identity") is None
+    assert middleware.level("application/json; charset=utf-8", "gzip") == 9
+    assert middleware.level("text/csv", "br") == 4
+    assert middleware.level("image/png", "br") is None
+    assert parse_compression_levels(["application/json:br:5"]) == {"application/json": {"br": 5}}
+
+
+@pytest.fixture
+def compression(core_config, executors):
+    core_config.update({"net_http_compression": True, "net_http_compression_offload_size": 16 * 1024})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+async def test_handler_compression(compression, executors, web_client, web_server: NetHttpServer, encoding):
+    async def handler(size: int):
+        return ["x" * 100] * size
+
+    web_server.add_get("/handle", handler)
+    for size, offloaded in ((1, 0), (100, 0), (1000, 1)):
+        executors.pools["cpu"].take_stats()
+        response = await web_client.get("handle", params={"size": size}, headers={"accept-encoding": encoding})
+        assert response.json() == ["x" * 100] * size
+        assert response.headers.get("content-encoding") == (encoding if size > 1 else None)
+        assert executors.pools["cpu"].take_stats()[2] == offloaded
+    response = await web_client.get("handle", params={"size": 100}, headers={"accept-encoding": "identity"})
+    assert "content-encoding" not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_stream_handler(web_client, web_server: NetHttpServer):
+    async def rows(count: int):
+        for i in range(count):
+            yield {"id": i, "name": f"row,{i}"}
+
+    web_server.add_stream_get("/ndjson", rows, chunk_size=16)
+    web_server.add_stream_get("/json", rows, format="json")
+    web_server.add_stream_get("/csv", rows, format="csv")
+    response = await web_client.get("ndjson", params={"count": 3})
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {"id": i, "name": f"row,{i}"} for i in range(3)
+    ]
+    assert (await web_client.get("json", params={"count": 2})).json() == [
+        {"id": 0, "name": "row,0"}, {"id": 1, "name": "row,1"},
+    ]
+    assert (await web_client.get("json", params={"count": 0})).json() == []
+    response = await web_client.get("csv", params={"count": 2})
+    assert response.text == 'id,name\r\n0,"row,0"\r\n1,"row,1"\r\n'
+    response = await web_client.get("ndjson")
+    assert response.status_code == 422
+    with pytest.raises(ValueError):
+        web_server.add_stream_get("/xml", rows, format="xml")
+
+
+@pytest.mark.asyncio
+async def test_stream_handler_client_disconnect(web_client, web_server: NetHttpServer):
+    closed = asyncio.Event()
+
+    async def rows():
+        try:
+            i = 0
+            while True:
+                yield {"id": i, "payload": "x" * 1000}
+                i += 1
+        finally:
+            closed.set()
+
+    web_server.add_stream_get("/rows", rows)
+    async with web_client.client.stream("GET", str(web_client.base_url / "rows")) as response:
+        async for line in response.aiter_lines():
+            assert json.loads(line)["id"] == 0
+            break
+    await asyncio.wait_for(closed.wait(), timeout=5)
+
+
+def test_server_connection_options(core_config):
+    core_config.update({
+        "net_http_keep_alive_timeout": 30.0,
+        "net_http_keep_alive_max_requests": 10,
+        "net_http_backlog": 256,
+        "net_http_h2_max_concurrent_streams": 64,
+        "net_http_http2": False,
+    })
+    config = net_http_server_from_config().hypercorn_config
+    assert (config.keep_alive_timeout, config.keep_alive_max_requests) == (30.0, 10)
+    assert (config.backlog, config.h2_max_concurrent_streams) == (256, 64)
+    assert config.alpn_protocols == ["http/1.1"]
+    assert config.quic_bind == []
+
+
+@pytest.mark.asyncio
+async def test_server_h2c(web_client, web_server: NetHttpServer):
+    async def handler(value: int):
+        return value
+
+    web_server.add_get("/handle", handler)
+    # wait for server to bind
+    await web_client.get("healthcheck")
+    async with httpx.AsyncClient(base_url=str(web_client.base_url), http1=False, http2=True) as client:
+        responses = await asyncio.gather(*[client.get("/handle", params={"value": i}) for i in range(20)])
+    assert {response.http_version for response in responses} == {"HTTP/2"}
+    assert [response.json() for response in responses] == list(range(20))
+
+
+class Item(BaseModel):
+    id: int
+    values: list[float]
+
+
+@pytest.fixture
+def msgpack_format(core_config):
+    core_config.update({"net_http_content_formats": ["json", "msgpack"]})
+
+
+@pytest.mark.asyncio
+async def test_msgpack_content_negotiation(msgpack_format, web_client, web_server: NetHttpServer):
+    async def create(item: Item) -> Item:
+        return item
+
+    async def untyped(item_id: int):
+        return {"id": item_id, "values": [0.5]}
+
+    web_server.add_post("/items", create)
+    web_server.add_get("/items/{item_id}", untyped, cache_ttl=60)
+    item = {"id": 1, "values": [1.5, 2.5]}
+    response = await web_client.post("items", json=item, content_format="msgpack")
+    assert response.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(response.content) == item
+    response = await web_client.get("items/2", content_format="msgpack")
+    assert response.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(response.content) == {"id": 2, "values": [0.5]}
+    response = await web_client.get("items/2")
+    assert response.json() == {"id": 2, "values": [0.5]}
+    assert response.headers["vary"] == "accept"
+
+    web_client.unpack_json = True
+    assert await web_client.post("items", json=item, content_format="msgpack") == item
+    assert await web_client.post("items", json=item) == item
+    data = await web_client.post("items", json={"id": "x"}, content_format="msgpack")
+    assert data["code"] == "common.validation_error"
+
+
+@pytest.mark.asyncio
+async def test_msgpack_client_json_server(web_client, web_server: NetHttpServer):
+    async def create(item: Item) -> Item:
+        return item
+
+    web_server.add_post("/items", create)
+    web_client.content_format = "msgpack"
+    response = await web_client.post("items", json={"id": 1, "values": []})
+    # server without msgpack support can't parse body
+    assert response.status_code == 422
+    response = await web_client.post("items", json={"id": 1, "values": []}, content_format="json")
+    assert response.headers["content-type"] == "application/json"
+
+
+@pytest.mark.asyncio
+async def test_client_from_config(core_config, web_client, web_server: NetHttpServer):
+    async def handler(request: Request):
+        return request.scope["http_version"]
+
+    web_server.add_get("/version", handler)
+    core_config.update({
+        "net_http_client_host": core_config.net_http_host,
+        "net_http_client_port": core_config.net_http_port,
+        "net_http_client_named": [f"other=http://{core_config.net_http_host}:{core_config.net_http_port}"],
+        "net_http_client_max_connections": 7,
+        "net_http_client_read_timeout": 3.0,
+        "net_http_client_unpack_json": True,
+    })
+    client = net_http_client_from_config()
+    assert client.limits.max_connections == 7
+    assert client.transport_timeout.read == 3.0
+    clients = net_http_clients_from_config()
+    assert list(clients) == ["other"]
+    assert clients["other"].base_url == client.base_url
+    async with client:
+        assert await client.get("version") == "1.1"
+
+    core_config.update({"net_http_client_http2": True})
+    async with net_http_client_from_config() as client:
+        assert await client.get("version") == "2"
+
+
+@pytest.mark.asyncio
+async def test_client_retries(web_client, web_server: NetHttpServer):
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise HTTPException(status_code=503)
+        return "ok"
+
+    web_server.add_get("/flaky", flaky)
+    web_server.add_post("/flaky", flaky)
+    web_client.retry = RetryPolicy(3, backoff=0.001)
+    response = await web_client.get("flaky")
+    assert response.json() == "ok"
+    assert len(calls) == 3
+    assert web_client.retry_budget.retries == 2
+
+    # non idempotent requests are not retried
+    calls.clear()
+    response = await web_client.post("flaky")
+    assert response.status_code == 503
+    assert len(calls) == 1
+
+    calls.clear()
+    response = await web_client.get("flaky", retry=False)
+    assert response.status_code == 503
+
+    # exhausted budget stops retries
+    calls.clear()
+    web_client.retry_budget = RetryBudget(min_tokens=0)
+    response = await web_client.get("flaky")
+    assert response.status_code == 503
+    assert len(calls) == 1
+    assert web_client.retry_budget.exhausted == 1
+
+
+def test_retry_policy_delay():
+    policy = RetryPolicy(backoff=0.1, backoff_max=0.3)
+    for attempt in range(5):
+        assert 0 <= policy.delay(attempt) <= min(0.3, 0.1 * 2 ** attempt)
+    response = httpx.Response(503, headers={"retry-after": "10"})
+    assert policy.delay(0, response) == 0.3
+
+
+@pytest.mark.asyncio
+async def test_client_hedging(web_client, web_server: NetHttpServer):
+    calls = []
+
+    async def slow_first():
+        calls.append(1)
+        if len(calls) == 1:
+            await asyncio.sleep(5)
+        return len(calls)
+
+    web_server.add_get("/slow", slow_first)
+    web_client.hedge = HedgePolicy(delay=0.05)
+    started = time.monotonic()
+    response = await web_client.get("slow")
+    assert time.monotonic() - started < 1
+    assert response.json() == 2
+    assert web_client.retry_budget.hedges == 1
+
+    # hedge delay follows observed latency
+    policy = HedgePolicy(0.9, min_samples=10)
+    assert policy.delay() is None
+    for value in range(1, 11):
+        policy.latency.observe(value / 100)
+    assert policy.delay() == 0.1
+
+
+@pytest.mark.asyncio
+async def test_client_cache(web_client, web_server: NetHttpServer):
+    now = [0.0]
+    calls = []
+
+    async def handler(request: Request):
+        calls.append(request.headers.get("if-none-match"))
+        if request.headers.get("if-none-match") == '"v1"':
+            return Response(status_code=304, headers={"cache-control": "max-age=10"})
+        return Response(b'"value"', media_type="application/json",
+                        headers={"cache-control": "max-age=10, stale-while-revalidate=10", "etag": '"v1"'})
+
+    async def uncacheable():
+        calls.append(None)
+        return "value"
+
+    web_server.add_get("/cached", handler)
+    web_server.add_get("/uncacheable", uncacheable)
+    web_client.cache = cache = HttpCache(clock=lambda: now[0])
+    web_client.unpack_json = True
+    assert await web_client.get("cached") == "value"
+    assert await web_client.get("cached") == "value"
+    assert (cache.misses, cache.hits, calls) == (1, 1, [None])
+
+    # stale entry is served right away and revalidated in background
+    now[0] = 15
+    assert await web_client.get("cached") == "value"
+    assert cache.stale_hits == 1
+    for _ in range(100):
+        if cache.revalidations:
+            break
+        await asyncio.sleep(0.01)
+    assert calls == [None, '"v1"']
+    assert await web_client.get("cached") == "value"
+    assert cache.hits == 2
+
+    # expired entry is revalidated before response
+    now[0] = 100
+    assert await web_client.get("cached") == "value"
+    assert (cache.revalidations, len(calls)) == (2, 3)
+
+    # responses without freshness and validators are not stored
+    calls.clear()
+    await web_client.get("uncacheable")
+    await web_client.get("uncacheable")
+    assert await web_client.get("uncacheable", cache=False) == "value"
+    assert len(calls) == 3
+    assert len(cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_client_cache_coalescing(web_client, web_server: NetHttpServer):
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "value"
+
+    web_server.add_get("/slow", slow, cache_ttl=60)
+    web_client.cache = cache = HttpCache()
+    responses = await asyncio.gather(*[web_client.get("slow") for _ in range(5)])
+    assert [response.json() for response in responses] == ["value"] * 5
+    assert (len(calls), cache.misses, cache.coalesced) == (1, 1, 4)
+
+    # server cache etag without max age makes client revalidate every request
+    response = await web_client.get("slow")
+    assert response.json() == "value"
+    assert (len(calls), cache.revalidations) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_client_fan_out(web_client, web_server: NetHttpServer):
+    running = 0
+    peak = 0
+
+    async def item(id: int):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        try:
+            await asyncio.sleep(0.01 * (id % 3))
+        finally:
+            running -= 1
+        if id == 7:
+            raise HTTPException(status_code=404)
+        return id
+
+    web_server.add_get("/items/{id}", item)
+    web_server.add_post("/items/{id}", item)
+    web_client.raise_for_status = True
+    web_client.unpack_json = True
+    results = [result async for result in web_client.fan_out([f"items/{i}" for i in range(30)], concurrency=4)]
+    assert peak <= 4
+    assert sorted(result.index for result in results) == list(range(30))
+    failed = [result for result in results if not result.ok]
+    assert len(failed) == 1 and failed[0].index == 7
+    assert isinstance(failed[0].error, HTTPStatusError)
+    assert all(result.value == result.index for result in results if result.ok)
+
+    requests = [{"suburl": f"items/{i}", "method": "POST"} for i in range(10)]
+    results = [result async for result in web_client.fan_out(requests, concurrency=3, ordered=True)]
+    assert [result.index for result in results] == list(range(10))
+
+    # early exit cancels requests in flight
+    results = web_client.fan_out((f"items/{i}" for i in range(100)), adaptive=True)
+    assert (await anext(results)).index < 100
+    await results.aclose()
+
+    # overload statuses shrink adaptive window whether response is raised for or unpacked
+    async def overloaded():
+        raise HTTPException(status_code=503, detail="busy")
+
+    web_server.add_get("/overloaded", overloaded)
+    for raise_for_status in (True, False):
+        web_client.raise_for_status = raise_for_status
+        limit = AdaptiveLimit(10)
+        result = await web_client._fan_out_call(0, "overloaded", limit)
+        assert result.ok is not raise_for_status
+        assert limit.window < 10
+
+
+def test_adaptive_limit():
+    limit = AdaptiveLimit(10, max_limit=50)
+    for _ in range(20):
+        limit.observe(0.01)
+    assert limit.window == 50
+    # queueing upstream raises latency and shrinks the window
+    for _ in range(20):
+        limit.observe(0.1)
+    assert limit.window < 20
+    window = limit.window
+    limit.observe(0.01, ok=False)
+    assert limit.window <= window
+    for _ in range(100):
+        limit.observe(1.0, ok=False)
+    assert limit.window == 1
+
+
+def test_circuit_breaker():
+    now = [0.0]
+    breaker = CircuitBreaker("test", min_requests=4, failure_rate=0.5, open_duration=10, half_open_requests=2,
+                             slow_call_duration=1.0, clock=lambda: now[0])
+    for ok in (True, False, True):
+        breaker.acquire()
+        breaker.record(0.1, ok)
+    assert breaker.state == "closed"
+    breaker.record(0.1, False)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+
+    # limited trial calls after open duration, failure opens circuit again
+    now[0] = 10
+    assert breaker.state == "half-open"
+    breaker.acquire()
+    breaker.acquire()
+    assert not breaker.allows()
+    breaker.record(0.1, True)
+    breaker.record(0.1, False)
+    assert breaker.state == "open"
+    now[0] = 20
+    for _ in range(2):
+        breaker.acquire()
+        breaker.record(0.1, True)
+    assert breaker.state == "closed"
+
+    # slow calls are counted separately from errors
+    for _ in range(4):
+        breaker.record(2.0, True)
+    assert breaker.state == "open"
+
+
+@pytest.mark.asyncio
+async def test_client_outlier_ejection(core_config, web_server: NetHttpServer, unused_tcp_port_factory):
+    async def ping():
+        return "pong"
+
+    web_server.add_get("/ping", ping)
+    host, port = core_config.net_http_host, core_config.net_http_port
+    dead = f"127.0.0.1:{unused_tcp_port_factory()}"
+    breaker_options = {"min_requests": 2, "open_duration": 60}
+    # server is started in background, its failures before binding would eject it
+    async with NetHttpClient(host, port, retry=RetryPolicy(50, backoff=0.01)) as client:
+        await client.get("ping")
+    async with NetHttpClient(host, port, hosts=[dead], breaker_options=breaker_options, timeout=5) as client:
+        failures = 0
+        for _ in range(30):
+            try:
+                await client.get("ping")
+            except httpx.TransportError:
+                failures += 1
+        healthy, ejected = client.upstreams
+        assert 1 <= failures <= 2
+        assert ejected.breaker.state == "open"
+        assert healthy.breaker.state == "closed"
+
+    async with NetHttpClient("127.0.0.1", int(dead.split(":")[1]), breaker_options=breaker_options) as client:
+        for _ in range(2):
+            with pytest.raises(httpx.TransportError):
+                await client.get("ping")
+        # all hosts are ejected, requests fail fast
+        with pytest.raises(CircuitOpenError):
+            await client.get("ping")
+
+
+@pytest.mark.asyncio
+async def test_client_breaker_request_timeout(unused_tcp_port_factory):
+    async def hang(reader, writer):
+        await reader.read()
+        writer.close()
+
+    port = unused_tcp_port_factory()
+    breaker_options = {"min_requests": 3, "window_size": 5, "slow_call_duration": 0.05}
+    async with await asyncio.start_server(hang, "127.0.0.1", port):
+        # request timeout is shorter than read timeout, so hung upstream is only seen as cancelled call
+        async with NetHttpClient("127.0.0.1", port, timeout=0.1, breaker_options=breaker_options) as client:
+            breaker = client.upstreams[0].breaker
+            for _ in range(3):
+                with pytest.raises(asyncio.TimeoutError):
+                    await client.get("ping")
+            assert breaker.state == "open"
+            with pytest.raises(CircuitOpenError):
+                await client.get("ping")
+
+
+@pytest.mark.asyncio
+async def test_client_streaming(web_client, web_server: NetHttpServer):
+    async def rows(count: int = 1000):
+        for i in range(count):
+            yield {"id": i, "name": f"row-{i}"}
+
+    async def upload(request: Request):
+        total = count = 0
+        async for item in decode_ndjson(request.stream()):
+            total += item["id"]
+            count += 1
+        return {"count": count, "total": total}
+
+    web_server.add_stream_get("/ndjson", rows, chunk_size=256)
+    web_server.add_stream_get("/json", rows, format="json", chunk_size=256)
+    web_server.add_stream_get("/csv", rows, format="csv")
+    web_server.add_post("/upload", upload)
+    expected = [{"id": i, "name": f"row-{i}"} for i in range(1000)]
+    assert [item async for item in web_client.iter_items("ndjson")] == expected
+    assert [item async for item in web_client.iter_items("json")] == expected
+    with pytest.raises(ValueError, match="Can't decode stream"):
+        async for _ in web_client.iter_items("csv"):
+            pass
+
+    chunks = [chunk async for chunk in web_client.iter_bytes("ndjson", params={"count": 10})]
+    assert b"".join(chunks).count(b"\n") == 10
+
+    # consumer stops early, connection is released
+    items = web_client.iter_items("ndjson", params={"count": 100000})
+    assert await anext(items) == expected[0]
+    await items.aclose()
+
+    response = await web_client.upload("upload", rows(), chunk_size=128)
+    assert response.json() == {"count": 1000, "total": sum(range(1000))}
+
+
+@pytest.mark.parametrize("fast_json", [True, False])
+@pytest.mark.asyncio
+async def test_client_json_encoding(fast_json, web_client, web_server: NetHttpServer):
+    async def echo(request: Request):
+        return {"content_type": request.headers["content-type"], "body": await request.json()}
+
+    web_server.add_post("/echo", echo)
+    web_client.fast_json = fast_json
+    web_client.unpack_json = True
+    payload = {
+        "item": Item(id=1, values=[0.5]),
+        "created": datetime.datetime(2023, 1, 2, 3, 4, 5),
+        "bytes": b"raw",
+        "nested": [{"a": None}],
+    }
+    expected = {
+        "item": {"id": 1, "values": [0.5]},
+        "created": "2023-01-02T03:04:05",
+        "bytes": "raw",
+        "nested": [{"a": None}],
+    }
+    response = await web_client.post("echo", json=payload, headers={"x-custom": "1"})
+    assert response == {"content_type": "application/json", "body": expected}
+    # non string keys are converted by fastapi encoder
+    response = await web_client.post("echo", json={1: "a"})
+    assert response["body"] == {"1": "a"}
+    assert await web_client.post("echo", json=[1, 2]) == {"content_type": "application/json", "body": [1, 2]}
+    assert list(web_client.upstreams[0].urls) == ["echo"]
+
+
+@pytest.mark.asyncio
+async def test_decode_json_array():
+    async def chunks(data: bytes, size: int):
+        for i in range(0, len(data), size):
+            yield data[i:i + size]
+
+    items = [{"a": i, "s": 'x,]"[é' * i} for i in range(20)] + [1, 2.5, -1e5, True, None, "z", 123456]
+    items += [[[], {"b": [1, {}]}], "\\", {"s": '\\"}'}]
+    data = json.dumps(items, ensure_ascii=False).encode()
+    for size in (1, 3, 64, len(data)):
+        assert [item async for item in decode_json_array(chunks(data, size))] == items
+    assert [item async for item in decode_json_array(chunks(b" [ ] ", 1))] == []
+    with pytest.raises(ValueError, match="Unexpected end"):
+        [item async for item in decode_json_array(chunks(b"[1, 2", 2))]
+    with pytest.raises(ValueError, match="Expect json array"):
+        [item async for item in decode_json_array(chunks(b"{}", 2))]
+
+    # syntax error is raised as soon as item is complete, not at the end of stream
+    async def endless(data: bytes):
+        yield data
+        while True:
+            yield b" "
+
+    for data in (b"[1, }", b'[{"a": 1]', b"[tru, 1", b"[1 2", b'["a" "b"', b"[1,,2", b"[1,]", b"[,1"):
+        with pytest.raises(json.JSONDecodeError):
+            [item async for item in decode_json_array(endless(data))]
+
+
+def _serve_pid(host, port):
+    async def pid():
+        return os.getpid()
+
+    async def main():
+        async with NetHttpServer(host, port) as server:
+            server.add_get("/pid", pid)
+            await server.wait()
+
+    asyncio.run(main())
+
+
+def _get_pid(url, attempts=100):
+    for _ in range(attempts):
+        try:
+            return httpx.get(url).json()
+        except httpx.TransportError:
+            time.sleep(0.05)
+    raise RuntimeError("Workers are not responding")
+
+
+@pytest.mark.parametrize("reuse_port", [False, True])
+def test_workers_supervisor(unused_tcp_port, reuse_port):
+    host = "127.0.0.1"
+    url = f"http://{host}:{unused_tcp_port}/pid"
+    target = functools.partial(_serve_pid, host, unused_tcp_port)
+    supervisor = WorkersSupervisor(target, 2, host=host, port=unused_tcp_port, reuse_port=reuse_port,
+                                   restart_delay=0.1)
+    process = multiprocessing.get_context("fork").Process(target=supervisor.run)
+    process.start()
+    try:
+        pids = {_get_pid(url) for _ in range(20)}
+        assert os.getpid() not in pids
+        killed = pids.pop()
+        os.kill(killed, signal.SIGKILL)
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            pid = _get_pid(url)
+            if pid not in pids and pid != killed:
+                break
+        else:
+            raise AssertionError("Worker was not restarted")
+    finally:
+        process.terminate()
+        process.join(10)
+    assert process.exitcode == 0
@@ -0,0 +1,79 @@
+import asyncio
+import functools
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any
+
+_KWARGS_MARK = object()
+_MISSING = object()
+
+
+def make_key(args: tuple, kwargs: dict) -> Hashable:
+    if not kwargs:
+        return args
+    return args + (_KWARGS_MARK,) + tuple(sorted(kwargs.items()))
+
+
+class AsyncCache:
+
+    def __init__(self, maxsize: int | None = 128, ttl: float | None = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        # key -> (expires at, value), ordered from least to most recently used
+        self._data: OrderedDict[Hashable, tuple[float | None, Any]] = OrderedDict()
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at is not None and expires_at <= self.clock():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value, ttl: float | None = _MISSING):
+        ttl = self.ttl if ttl is _MISSING else ttl
+        self._data[key] = (None if ttl is None else self.clock() + ttl), value
+        self._data.move_to_end(key)
+        if self.maxsize is not None:
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def _store(self, key, ttl, future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        if not future.cancelled() and future.exception() is None:
+            self.set(key, future.result(), ttl)
+
+    async def get_or_compute(self, key: Hashable, factory: Callable[[], Awaitable], ttl: float | None = _MISSING):
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        future = self._in_flight.get(key)
+        if future is None:
+            self.misses += 1
+            # computation is not bound to the first caller, so its cancellation won't affect the others
+            future = self._in_flight[key] = asyncio.ensure_future(factory())
+            future.add_done_callback(functools.partial(self._store, key, ttl))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
@@ -0,0 +1,21 @@
+# flake8: noqa
+from .executors import (
+    CPU_BACKENDS,
+    CPU_COUNT,
+    Executors,
+    blocking_cpu_function,
+    blocking_io_function,
+    cached_blocking_cpu_function,
+    cached_blocking_io_function,
+    executors_from_config,
+    executors_options,
+)
+from .autoscale import ExecutorPoolAutoscaler
+from .pool import (
+    ADMISSION_MODES,
+    POOL_KINDS,
+    ExecutorDeadlineExceededError,
+    ExecutorPool,
+    ExecutorPoolOverloadedError,
+)
+from .shared_memory import SharedMemoryPool
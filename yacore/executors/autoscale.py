@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import time
+
+from yacore.executors.pool import ExecutorPool
+
+POOL_SIZE_METRIC = "yacore_executor_pool_size"
+RESIZES_METRIC = "yacore_executor_pool_resizes_total"
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorPoolAutoscaler:
+
+    def __init__(self, pool: ExecutorPool, min_size: int, max_size: int, *, interval: float = 1.0,
+                 grow_queue_wait: float = 0.005, shrink_utilization: float = 0.5, shrink_intervals: int = 5,
+                 on_resize=None):
+        if not 1 <= min_size <= max_size <= pool.max_size:
+            raise ValueError(f"Autoscale bounds [{min_size}, {max_size}] are out of {pool.name!r} pool limits")
+        self.pool = pool
+        self.min_size = min_size
+        self.max_size = max_size
+        self.interval = interval
+        self.grow_queue_wait = grow_queue_wait
+        self.shrink_utilization = shrink_utilization
+        self.shrink_intervals = shrink_intervals
+        self.on_resize = on_resize
+        self._idle_intervals = 0
+
+    def decide(self, elapsed: float) -> int:
+        busy, queue_wait, calls = self.pool.take_stats()
+        size = self.pool.size
+        utilization = busy / (elapsed * size) if elapsed > 0 else 0.0
+        average_wait = queue_wait / calls if calls else 0.0
+        if (average_wait > self.grow_queue_wait or self.pool.queued) and size < self.max_size:
+            self._idle_intervals = 0
+            return min(self.max_size, size + max(1, size // 2))
+        # hysteresis: grow fast on first sign of queueing, shrink slowly after several idle intervals
+        if utilization < self.shrink_utilization and size > self.min_size:
+            self._idle_intervals += 1
+            if self._idle_intervals >= self.shrink_intervals:
+                self._idle_intervals = 0
+                return max(self.min_size, size - max(1, size // 4))
+        else:
+            self._idle_intervals = 0
+        return size
+
+    def step(self, elapsed: float):
+        old = self.pool.size
+        new = self.decide(elapsed)
+        if new == old:
+            return
+        self.pool.resize(new)
+        direction = "up" if new > old else "down"
+        logger.info("Executor pool %r resized %s from %d to %d", self.pool.name, direction, old, new)
+        self.pool.metrics.set(POOL_SIZE_METRIC, new, pool=self.pool.name)
+        self.pool.metrics.increment(RESIZES_METRIC, pool=self.pool.name, direction=direction)
+        if self.on_resize is not None:
+            self.on_resize(self.pool, old, new)
+
+    async def run(self):
+        self.pool.metrics.set(POOL_SIZE_METRIC, self.pool.size, pool=self.pool.name)
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.step(now - last)
+            last = now
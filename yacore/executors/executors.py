@@ -0,0 +1,279 @@
+import asyncio
+import functools
+import importlib
+import itertools
+import os
+import pickle
+
+from click import Choice
+from cock import Option, build_options_from_dict
+from facet import ServiceMixin
+
+from yacore.cache import AsyncCache, make_key
+from yacore.executors.autoscale import ExecutorPoolAutoscaler
+from yacore.executors.pool import ADMISSION_MODES, POOL_KINDS, ExecutorPool, function_label
+from yacore.executors.shared_memory import SharedMemoryPool
+from yacore.gather import windowed_gather
+from yacore.injector import inject, register
+from yacore.metrics import MetricsSink
+
+try:
+    CPU_COUNT = len(os.sched_getaffinity(0))
+except AttributeError:
+    CPU_COUNT = os.cpu_count() or 1
+if CPU_COUNT is None:
+    # TODO: think of more elegant logic here
+    CPU_COUNT = 4
+
+CPU_BACKENDS = POOL_KINDS
+
+executors_options = build_options_from_dict({
+    "executors": {
+        "io_threads_count": Option(default=32, type=int),
+        "io_max_queue": Option(default=None, type=int),
+        # grow and shrink io pool between `io_threads_min` and `io_threads_count` by observed load
+        "io_autoscale": Option(default=False, type=bool),
+        "io_threads_min": Option(default=4, type=int),
+        "io_autoscale_interval": Option(default=1.0, type=float),
+        # https://docs.python.org/3/library/concurrent.futures.html#concurrent.futures.ThreadPoolExecutor
+        "cpu_threads_count": Option(default=min(32, CPU_COUNT + 4), type=int),
+        "cpu_backend": Option(default="thread", type=Choice(CPU_BACKENDS)),
+        "cpu_prewarm": Option(default=False, type=bool),
+        # "package.module:function" called once in every cpu worker
+        "cpu_initializer": Option(default=None),
+        # move buffers larger than this number of bytes to/from process workers via shared memory
+        "cpu_shared_memory_threshold": Option(default=None, type=int),
+        "cpu_max_queue": Option(default=None, type=int),
+        # what to do with a call when pool queue is full: fail fast or wait for a free place
+        "admission": Option(default="reject", type=Choice(ADMISSION_MODES)),
+        # named pools in "name:kind:size[:max_queue[:admission]]" format, e.g. "s3:thread:8:100:wait"
+        "pools": Option(default=(), multiple=True),
+    },
+})
+
+
+def import_object(path: str):
+    module_name, _, qualname = path.partition(":")
+    obj = importlib.import_module(module_name)
+    for name in filter(None, qualname.split(".")):
+        obj = getattr(obj, name)
+    return obj
+
+
+class FunctionReference:
+    # decorated module-level functions are shadowed by their wrappers, so pickle can't find
+    # them by name, reference resolves wrapper in worker and calls original function instead
+
+    def __init__(self, module: str, qualname: str):
+        self.module = module
+        self.qualname = qualname
+
+    def __call__(self, *args, **kwargs):
+        f = import_object(f"{self.module}:{self.qualname}")
+        return getattr(f, "__wrapped__", f)(*args, **kwargs)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.module}:{self.qualname})"
+
+
+def picklable_reference(f):
+    module = getattr(f, "__module__", None)
+    qualname = getattr(f, "__qualname__", None)
+    if module and qualname and "<" not in qualname:
+        return FunctionReference(module, qualname)
+    try:
+        pickle.dumps(f)
+    except Exception:
+        return None
+    return f
+
+
+def _run_chunk(f, chunk):
+    return [f(*args) for args in chunk]
+
+
+def _blocking_function(f, pool):
+    # check picklability once, at decoration time, instead of on every call
+    reference = picklable_reference(f)
+    label = function_label(f)
+
+    def target(executors):
+        kind = executors.get_pool(pool).kind
+        if kind == "thread":
+            return f
+        if reference is None:
+            raise TypeError(f"{f!r} is not picklable and can't be used with {kind!r} executor pool {pool!r}, "
+                            "define it at module level")
+        return reference
+
+    @functools.wraps(f)
+    @inject
+    async def wrapper(*args, executors, **kwargs):
+        return await executors.submit(pool, target(executors), args, kwargs, label=label)
+
+    @inject
+    def mapper(*iterables, executors, **options):
+        return executors.map(pool, target(executors), *iterables, label=label, **options)
+
+    wrapper.map = mapper
+    return wrapper
+
+
+def blocking_io_function(f=None, *, pool="io"):
+    if f is None:
+        return functools.partial(blocking_io_function, pool=pool)
+    return _blocking_function(f, pool)
+
+
+def blocking_cpu_function(f=None, *, pool="cpu"):
+    if f is None:
+        return functools.partial(blocking_cpu_function, pool=pool)
+    return _blocking_function(f, pool)
+
+
+def _cached_blocking_function(decorator, f, pool, maxsize, ttl, key):
+    blocking = decorator(f, pool=pool)
+    cache = AsyncCache(maxsize=maxsize, ttl=ttl)
+
+    @functools.wraps(f)
+    async def wrapper(*args, **kwargs):
+        cache_key = make_key(args, kwargs) if key is None else key(*args, **kwargs)
+        return await cache.get_or_compute(cache_key, lambda: blocking(*args, **kwargs))
+
+    wrapper.cache = cache
+    wrapper.map = blocking.map
+    return wrapper
+
+
+def cached_blocking_io_function(f=None, *, pool="io", maxsize=128, ttl=None, key=None):
+    if f is None:
+        return functools.partial(cached_blocking_io_function, pool=pool, maxsize=maxsize, ttl=ttl, key=key)
+    return _cached_blocking_function(blocking_io_function, f, pool, maxsize, ttl, key)
+
+
+def cached_blocking_cpu_function(f=None, *, pool="cpu", maxsize=128, ttl=None, key=None):
+    if f is None:
+        return functools.partial(cached_blocking_cpu_function, pool=pool, maxsize=maxsize, ttl=ttl, key=key)
+    return _cached_blocking_function(blocking_cpu_function, f, pool, maxsize, ttl, key)
+
+
+class Executors(ServiceMixin):
+
+    def __init__(self, io_threads_count, cpu_threads_count, *, cpu_backend="thread", cpu_prewarm=False,
+                 cpu_initializer=None, cpu_initargs=(), cpu_shared_memory_threshold=None, io_max_queue=None,
+                 cpu_max_queue=None, admission="reject", pools=(), metrics: MetricsSink | None = None,
+                 io_autoscale=False, io_threads_min=4, io_autoscale_interval=1.0):
+        if cpu_backend not in CPU_BACKENDS:
+            raise ValueError(f"Unknown cpu backend {cpu_backend!r}, expect one of {CPU_BACKENDS}")
+        if isinstance(cpu_initializer, str):
+            cpu_initializer = import_object(cpu_initializer)
+        self.io_threads_count = io_threads_count
+        self.cpu_threads_count = cpu_threads_count
+        self.cpu_backend = cpu_backend
+        self.cpu_shared_memory_threshold = cpu_shared_memory_threshold
+        self.metrics = metrics or MetricsSink()
+        io_size = min(io_threads_min, io_threads_count) if io_autoscale else io_threads_count
+        self.pools = {
+            "io": ExecutorPool("io", "thread", io_size, max_size=io_threads_count, max_queue=io_max_queue,
+                               admission=admission),
+            "cpu": ExecutorPool("cpu", cpu_backend, cpu_threads_count, max_queue=cpu_max_queue, admission=admission,
+                                prewarm=cpu_prewarm, initializer=cpu_initializer, initargs=cpu_initargs),
+        }
+        for pool in pools:
+            if pool.name in self.pools:
+                raise ValueError(f"Executor pool {pool.name!r} already exist")
+            self.pools[pool.name] = pool
+        for pool in self.pools.values():
+            pool.metrics = self.metrics
+        self.io_autoscaler = None
+        if io_autoscale:
+            io_pool = self.pools["io"]
+            self.io_autoscaler = ExecutorPoolAutoscaler(io_pool, io_pool.size, io_threads_count,
+                                                        interval=io_autoscale_interval)
+
+        self.shared_memory = None
+        self.loop = None
+
+    @property
+    def io_executor(self):
+        return self.pools["io"].executor
+
+    @property
+    def cpu_executor(self):
+        return self.pools["cpu"].executor
+
+    def get_pool(self, name) -> ExecutorPool:
+        try:
+            return self.pools[name]
+        except KeyError:
+            raise ValueError(f"Unknown executor pool {name!r}") from None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        if self.cpu_shared_memory_threshold is not None:
+            if any(pool.kind != "thread" for pool in self.pools.values()):
+                self.shared_memory = SharedMemoryPool(self.cpu_shared_memory_threshold)
+        for pool in self.pools.values():
+            await pool.start(self.shared_memory)
+        if self.io_autoscaler is not None:
+            self.add_task(self.io_autoscaler.run())
+
+    async def stop(self):
+        for pool in self.pools.values():
+            if pool.executor is not None:
+                pool.shutdown()
+        if self.shared_memory is not None:
+            self.shared_memory.close()
+
+    async def call(self, pool, f, *args, **kwargs):
+        return await self.get_pool(pool).call(f, *args, **kwargs)
+
+    async def submit(self, pool, f, args=(), kwargs=None, *, priority=0, deadline=None, label=None):
+        # deadline is in `loop.time()` terms, calls which are still queued at deadline are dropped
+        return await self.get_pool(pool).submit(f, args, kwargs, priority=priority, deadline=deadline, label=label)
+
+    async def blocking_io_call(self, f, *args, **kwargs):
+        return await self.call("io", f, *args, **kwargs)
+
+    async def blocking_cpu_call(self, f, *args, **kwargs):
+        return await self.call("cpu", f, *args, **kwargs)
+
+    async def _map(self, pool, f, iterables, chunk_size, window, ordered, label):
+        items = zip(*iterables)
+        chunk_call = functools.partial(_run_chunk, f)
+        chunks = iter(lambda: list(itertools.islice(items, chunk_size)), [])
+        calls = (pool.submit(chunk_call, (chunk,), label=label) for chunk in chunks)
+        async for results in windowed_gather(calls, window, ordered):
+            for result in results:
+                yield result
+
+    def map(self, pool, f, *iterables, chunk_size=16, window=None, ordered=True, label=None):
+        pool = self.get_pool(pool)
+        return self._map(pool, f, iterables, chunk_size, window or pool.size, ordered, label or function_label(f))
+
+    def map_io(self, f, *iterables, **options):
+        return self.map("io", f, *iterables, **options)
+
+    def map_cpu(self, f, *iterables, **options):
+        return self.map("cpu", f, *iterables, **options)
+
+
+@register(name="executors", singleton=True)
+@inject
+def executors_from_config(config, metrics):
+    return Executors(
+        io_threads_count=config.executors_io_threads_count,
+        cpu_threads_count=config.executors_cpu_threads_count,
+        cpu_backend=config.executors_cpu_backend,
+        cpu_prewarm=config.executors_cpu_prewarm,
+        cpu_initializer=config.executors_cpu_initializer,
+        cpu_shared_memory_threshold=config.executors_cpu_shared_memory_threshold,
+        io_max_queue=config.executors_io_max_queue,
+        cpu_max_queue=config.executors_cpu_max_queue,
+        admission=config.executors_admission,
+        io_autoscale=config.executors_io_autoscale,
+        io_threads_min=config.executors_io_threads_min,
+        io_autoscale_interval=config.executors_io_autoscale_interval,
+        pools=[ExecutorPool.from_spec(spec) for spec in config.executors_pools],
+        metrics=metrics,
+    )
@@ -0,0 +1,258 @@
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from yacore.metrics import MetricsSink
+
+POOL_KINDS = ("thread", "process", "interpreter")
+ADMISSION_MODES = ("reject", "wait")
+
+QUEUE_WAIT_METRIC = "yacore_executor_queue_wait_seconds"
+RUN_TIME_METRIC = "yacore_executor_run_seconds"
+IN_FLIGHT_METRIC = "yacore_executor_in_flight"
+REJECTIONS_METRIC = "yacore_executor_rejections_total"
+
+
+class ExecutorPoolOverloadedError(RuntimeError):
+    pass
+
+
+class ExecutorDeadlineExceededError(TimeoutError):
+    pass
+
+
+def _noop():
+    pass
+
+
+def function_label(f) -> str:
+    return getattr(f, "__qualname__", None) or type(f).__qualname__
+
+
+class ExecutorPool:
+
+    def __init__(self, name, kind="thread", size=1, *, max_queue=None, admission="reject", prewarm=False,
+                 initializer=None, initargs=(), metrics: MetricsSink | None = None, max_size=None):
+        if kind not in POOL_KINDS:
+            raise ValueError(f"Unknown executor pool kind {kind!r}, expect one of {POOL_KINDS}")
+        if admission not in ADMISSION_MODES:
+            raise ValueError(f"Unknown admission mode {admission!r}, expect one of {ADMISSION_MODES}")
+        self.name = name
+        self.kind = kind
+        self.size = size
+        # upper bound for `resize`, executor is created with this number of workers
+        self.max_size = max(size, max_size or size)
+        self.max_queue = max_queue
+        self.admission = admission
+        self.prewarm = prewarm
+        self.initializer = initializer
+        self.initargs = initargs
+        self.metrics = metrics or MetricsSink()
+
+        self.executor = None
+        self.shared_memory = None
+        self.loop = None
+        # number of occupied workers, work is handed to executor only when there is a free one,
+        # so executor internal queue stays empty and all queueing happens here
+        self.running = 0
+        self.queued = 0
+        self._queue = []
+        self._counter = itertools.count()
+        self._space_waiters = deque()
+        self._in_flight = Counter()
+        # accumulated since last `take_stats` call
+        self._busy_time = 0.0
+        self._busy_since = time.monotonic()
+        self._queue_wait_time = 0.0
+        self._calls_count = 0
+
+    @classmethod
+    def from_spec(cls, spec: str):
+        # "name:kind:size[:max_queue[:admission]]", e.g. "s3:thread:8:100:wait"
+        name, kind, size, *rest = spec.split(":")
+        max_queue = int(rest[0]) if rest and rest[0] else None
+        admission = rest[1] if len(rest) > 1 else "reject"
+        return cls(name, kind, int(size), max_queue=max_queue, admission=admission)
+
+    @property
+    def pending(self) -> int:
+        return self.running + self.queued
+
+    def _create_executor(self):
+        kwargs = dict(max_workers=self.max_size, initializer=self.initializer, initargs=self.initargs)
+        if self.kind == "thread":
+            return ThreadPoolExecutor(**kwargs)
+        if self.kind == "process":
+            return ProcessPoolExecutor(**kwargs)
+        executor_class = getattr(concurrent.futures, "InterpreterPoolExecutor", None)
+        if executor_class is None:
+            raise RuntimeError("'interpreter' executor pool kind is not available for this python version")
+        return executor_class(**kwargs)
+
+    async def start(self, shared_memory=None):
+        self.loop = asyncio.get_running_loop()
+        self.executor = self._create_executor()
+        if self.kind != "thread":
+            self.shared_memory = shared_memory
+        if self.prewarm:
+            await asyncio.gather(*[self.call(_noop) for _ in range(self.size)])
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+    def resize(self, size):
+        if self.kind != "thread":
+            raise ValueError(f"Only thread executor pools can be resized, {self.name!r} is {self.kind!r}")
+        if not 1 <= size <= self.max_size:
+            raise ValueError(f"Executor pool {self.name!r} size should be in [1, {self.max_size}], got {size}")
+        shrink = size < self.size
+        self._account_busy_time()
+        self.size = size
+        if shrink and self.executor is not None:
+            # thread pool executor never stops idle threads, so replace it, busy threads of
+            # the old one will finish their work and exit
+            old, self.executor = self.executor, self._create_executor()
+            old.shutdown(wait=False)
+        self._dispatch()
+
+    def _account_busy_time(self):
+        now = time.monotonic()
+        self._busy_time += self.running * (now - self._busy_since)
+        self._busy_since = now
+
+    def take_stats(self) -> tuple[float, float, int]:
+        # worker busy seconds, queue wait seconds and calls count since previous call
+        self._account_busy_time()
+        stats = self._busy_time, self._queue_wait_time, self._calls_count
+        self._busy_time = self._queue_wait_time = 0.0
+        self._calls_count = 0
+        return stats
+
+    def _wake_space_waiter(self):
+        while self._space_waiters:
+            waiter = self._space_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def _dispatch(self):
+        while self._queue and self.running < self.size:
+            _, _, ticket, deadline = heapq.heappop(self._queue)
+            if ticket.done():
+                continue
+            self.queued -= 1
+            self._wake_space_waiter()
+            if deadline is not None and self.loop.time() >= deadline:
+                ticket.set_exception(ExecutorDeadlineExceededError(f"Deadline exceeded in {self.name!r} queue"))
+                continue
+            self._account_busy_time()
+            self.running += 1
+            ticket.set_result(None)
+
+    def _release(self):
+        self._account_busy_time()
+        self.running -= 1
+        self._dispatch()
+
+    async def _wait_for_space(self):
+        while self.max_queue is not None and self.queued >= self.max_queue:
+            if self.admission == "reject":
+                raise ExecutorPoolOverloadedError(f"Executor pool {self.name!r} is overloaded")
+            waiter = self.loop.create_future()
+            self._space_waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # pass wake up to the next waiter if this one was already woken up
+                if waiter.done() and not waiter.cancelled():
+                    self._wake_space_waiter()
+                raise
+
+    async def _acquire(self, priority, deadline):
+        if self.running < self.size and not self.queued:
+            if deadline is not None and self.loop.time() >= deadline:
+                raise ExecutorDeadlineExceededError(f"Deadline exceeded before {self.name!r} call")
+            self._account_busy_time()
+            self.running += 1
+            return
+        try:
+            async with asyncio.timeout_at(deadline):
+                await self._wait_for_space()
+                ticket = self.loop.create_future()
+                # smaller priority value is dispatched first, same priority calls are served in order
+                heapq.heappush(self._queue, (priority, next(self._counter), ticket, deadline))
+                self.queued += 1
+                # worker may have been freed while waiting for space, with nobody left to dispatch
+                self._dispatch()
+                try:
+                    await ticket
+                except asyncio.CancelledError:
+                    # task cancellation cancels awaited ticket as well
+                    if ticket.cancelled() or not ticket.done():
+                        ticket.cancel()
+                        self.queued -= 1
+                        self._wake_space_waiter()
+                    elif ticket.exception() is None:
+                        # worker was granted, but caller gone, so give it to the next one
+                        self._release()
+                    raise
+        except TimeoutError:
+            raise ExecutorDeadlineExceededError(f"Deadline exceeded in {self.name!r} queue") from None
+
+    def _submit(self, f, *args, **kwargs):
+        try:
+            future = self.executor.submit(f, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        # worker is occupied until function is done, even if caller was cancelled
+        future.add_done_callback(lambda _: self.loop.call_soon_threadsafe(self._release))
+        return future
+
+    async def _execute(self, f, args, kwargs):
+        if self.shared_memory is not None:
+            submitted = False
+
+            def submit(*args, **kwargs):
+                nonlocal submitted
+                submitted = True
+                return self._submit(*args, **kwargs)
+
+            try:
+                return await self.shared_memory.call(submit, f, *args, **kwargs)
+            except BaseException:
+                if not submitted:
+                    self._release()
+                raise
+        return await asyncio.wrap_future(self._submit(f, *args, **kwargs))
+
+    async def submit(self, f, args=(), kwargs=None, *, priority=0, deadline=None, label=None):
+        label = label or function_label(f)
+        enqueued = time.monotonic()
+        try:
+            await self._acquire(priority, deadline)
+        except ExecutorPoolOverloadedError:
+            self.metrics.increment(REJECTIONS_METRIC, pool=self.name, function=label, reason="overloaded")
+            raise
+        except ExecutorDeadlineExceededError:
+            self.metrics.increment(REJECTIONS_METRIC, pool=self.name, function=label, reason="deadline")
+            raise
+        started = time.monotonic()
+        self._queue_wait_time += started - enqueued
+        self._calls_count += 1
+        self.metrics.observe(QUEUE_WAIT_METRIC, started - enqueued, pool=self.name, function=label)
+        self._in_flight[label] += 1
+        self.metrics.set(IN_FLIGHT_METRIC, self._in_flight[label], pool=self.name, function=label)
+        try:
+            return await self._execute(f, args, kwargs or {})
+        finally:
+            self._in_flight[label] -= 1
+            self.metrics.set(IN_FLIGHT_METRIC, self._in_flight[label], pool=self.name, function=label)
+            self.metrics.observe(RUN_TIME_METRIC, time.monotonic() - started, pool=self.name, function=label)
+
+    async def call(self, f, *args, **kwargs):
+        return await self.submit(f, args, kwargs)
@@ -0,0 +1,257 @@
+import asyncio
+import ctypes
+from collections import defaultdict
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any
+
+MIN_SEGMENT_SIZE = 4096
+# copies between caller and segments over this size are done in a thread
+OFFLOAD_COPY_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class SharedBuffer:
+    name: str
+    nbytes: int
+    kind: str
+    format: str | None = None
+    shape: tuple[int, ...] | None = None
+
+
+def _buffer_kind(value) -> str | None:
+    if isinstance(value, bytes):
+        return "bytes"
+    if isinstance(value, bytearray):
+        return "bytearray"
+    if isinstance(value, memoryview):
+        return "memoryview"
+    if type(value).__module__ == "numpy" and hasattr(value, "__array_interface__"):
+        return "ndarray"
+    return None
+
+
+def _byte_view(value) -> memoryview:
+    view = memoryview(value)
+    if not view.c_contiguous:
+        view = memoryview(view.tobytes())
+    return view.cast("B")
+
+
+def _segment_size(nbytes: int) -> int:
+    return max(MIN_SEGMENT_SIZE, 1 << (nbytes - 1).bit_length())
+
+
+def _describe(segment: SharedMemory, value, kind: str, nbytes: int) -> SharedBuffer:
+    if kind == "ndarray":
+        return SharedBuffer(segment.name, nbytes, kind, value.dtype.str, value.shape)
+    if kind == "memoryview":
+        return SharedBuffer(segment.name, nbytes, kind, value.format, value.shape)
+    return SharedBuffer(segment.name, nbytes, kind)
+
+
+def _materialize(view: memoryview, shared: SharedBuffer):
+    if shared.kind == "bytes":
+        return bytes(view)
+    if shared.kind == "bytearray":
+        return bytearray(view)
+    if shared.kind == "memoryview":
+        return view.cast(shared.format, shared.shape)
+    import numpy
+    return numpy.ndarray(shared.shape, dtype=shared.format, buffer=view)
+
+
+def _copy(target: memoryview, source):
+    # ctypes foreign calls release gil, so copy in a thread does not stall event loop
+    nbytes = target.nbytes
+    try:
+        if not isinstance(source, bytes):
+            source = (ctypes.c_char * nbytes).from_buffer(source)
+        ctypes.memmove((ctypes.c_char * nbytes).from_buffer(target), source, nbytes)
+    except TypeError:
+        # read-only buffer, which is not bytes
+        target[:] = source
+
+
+def _copy_out(view: memoryview, shared: SharedBuffer):
+    if shared.kind == "bytes":
+        return bytes(view)
+    data = bytearray(shared.nbytes)
+    _copy(memoryview(data), view)
+    if shared.kind == "bytearray":
+        return data
+    return _materialize(memoryview(data), shared)
+
+
+async def _offload(copy, *args):
+    future = asyncio.get_running_loop().run_in_executor(None, copy, *args)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        # segment can't be released while thread is still using it
+        await future
+        raise
+
+
+def _close(segment: SharedMemory, views: list[memoryview]):
+    try:
+        for view in views:
+            view.release()
+        segment.close()
+    except BufferError:
+        # function kept a reference to the buffer, let garbage collector close the segment
+        pass
+
+
+class SharedMemoryCall:
+    # executed in worker: maps shared buffers of arguments and moves large result to a new segment
+
+    def __init__(self, f, threshold: int):
+        self.f = f
+        self.threshold = threshold
+
+    def _attach(self, value, opened: list):
+        if not isinstance(value, SharedBuffer):
+            return value
+        segment = SharedMemory(name=value.name)
+        view = segment.buf[:value.nbytes]
+        opened.append((segment, [view]))
+        return _materialize(view, value)
+
+    def _export(self, value):
+        kind = _buffer_kind(value)
+        if kind is None:
+            return value
+        view = _byte_view(value)
+        if view.nbytes < self.threshold:
+            return value
+        segment = SharedMemory(create=True, size=view.nbytes)
+        segment.buf[:view.nbytes] = view
+        shared = _describe(segment, value, kind, view.nbytes)
+        segment.close()
+        return shared
+
+    def __call__(self, *args, **kwargs):
+        opened = []
+        try:
+            args = [self._attach(value, opened) for value in args]
+            kwargs = {key: self._attach(value, opened) for key, value in kwargs.items()}
+            result = self.f(*args, **kwargs)
+            del args, kwargs
+            return self._export(result)
+        finally:
+            for segment, views in opened:
+                _close(segment, views)
+
+
+class SharedMemoryPool:
+
+    def __init__(self, threshold: int, max_free_segments: int = 8, offload_size: int = OFFLOAD_COPY_SIZE):
+        self.threshold = threshold
+        self.offload_size = offload_size
+        self.max_free_segments = max_free_segments
+        self._free: dict[int, list[SharedMemory]] = defaultdict(list)
+        self._closed = False
+        # workers should share parent resource tracker, otherwise they will unlink segments on exit
+        resource_tracker.ensure_running()
+
+    @property
+    def free_segments_count(self) -> int:
+        return sum(map(len, self._free.values()))
+
+    def acquire(self, nbytes: int) -> SharedMemory:
+        free = self._free[_segment_size(nbytes)]
+        if free:
+            return free.pop()
+        return SharedMemory(create=True, size=_segment_size(nbytes))
+
+    def release(self, segment: SharedMemory):
+        free = self._free[segment.size]
+        if self._closed or len(free) >= self.max_free_segments:
+            segment.close()
+            segment.unlink()
+        else:
+            free.append(segment)
+
+    def close(self):
+        self._closed = True
+        for free in self._free.values():
+            while free:
+                segment = free.pop()
+                segment.close()
+                segment.unlink()
+
+    async def _share(self, value, segments: list[SharedMemory]):
+        kind = _buffer_kind(value)
+        if kind is None:
+            return value
+        view = _byte_view(value)
+        if view.nbytes < self.threshold:
+            return value
+        segment = self.acquire(view.nbytes)
+        segments.append(segment)
+        with segment.buf[:view.nbytes] as target:
+            source = value if kind == "bytes" else view
+            if view.nbytes >= self.offload_size:
+                await _offload(_copy, target, source)
+            else:
+                _copy(target, source)
+        return _describe(segment, value, kind, view.nbytes)
+
+    async def _load(self, value):
+        if not isinstance(value, SharedBuffer):
+            return value
+        segment = SharedMemory(name=value.name)
+        view = segment.buf[:value.nbytes]
+        try:
+            # copy out, so segment can be unlinked right away
+            if value.nbytes >= self.offload_size:
+                return await _offload(_copy_out, view, value)
+            return _copy_out(view, value)
+        finally:
+            _close(segment, [view])
+            segment.unlink()
+
+    def _discard(self, value):
+        if isinstance(value, SharedBuffer):
+            segment = SharedMemory(name=value.name)
+            segment.close()
+            segment.unlink()
+
+    def _complete(self, future, waiter: asyncio.Future, segments: list[SharedMemory]):
+        for segment in segments:
+            self.release(segment)
+        if future.cancelled():
+            waiter.cancel()
+        elif future.exception() is not None:
+            if not waiter.done():
+                waiter.set_exception(future.exception())
+        elif waiter.done():
+            self._discard(future.result())
+        else:
+            waiter.set_result(future.result())
+
+    async def call(self, submit, f, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        segments = []
+        try:
+            args = [await self._share(value, segments) for value in args]
+            kwargs = {key: await self._share(value, segments) for key, value in kwargs.items()}
+            future = submit(SharedMemoryCall(f, self.threshold), *args, **kwargs)
+        except BaseException:
+            for segment in segments:
+                self.release(segment)
+            raise
+        # segments are released only when worker is done with them, even if caller was cancelled
+        waiter = loop.create_future()
+        waiter.add_done_callback(lambda _: future.cancel())
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._complete, future, waiter, segments))
+        try:
+            result = await waiter
+        except asyncio.CancelledError:
+            # result segment was handed over right before cancellation
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                self._discard(waiter.result())
+            raise
+        return await self._load(result)
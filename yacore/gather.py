@@ -0,0 +1,37 @@
+import asyncio
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+
+
+async def windowed_gather(awaitables: Iterable[Awaitable], window: int | Callable[[], int],
+                          ordered: bool = True) -> AsyncIterator:
+    # at most `window` awaitables run at once, next ones are taken lazily as running ones complete
+    # callable window is read before each refill, so it can change while gathering
+    awaitables = iter(awaitables)
+    pending = deque()
+    exhausted = False
+    try:
+        while True:
+            size = window() if callable(window) else window
+            while not exhausted and len(pending) < size:
+                awaitable = next(awaitables, None)
+                if awaitable is None:
+                    exhausted = True
+                else:
+                    pending.append(asyncio.ensure_future(awaitable))
+            if not pending:
+                return
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.remove(task)
+            for task in done:
+                yield await task
+    finally:
+        for task in pending:
+            if task.done() and not task.cancelled():
+                task.exception()
+            else:
+                task.cancel()
@@ -0,0 +1,28 @@
+import asyncio
+
+from click import Choice
+from cock import Option, build_options_from_dict
+
+from yacore.injector import inject
+
+LOOPS = ("asyncio", "uvloop")
+
+loop_options = build_options_from_dict({
+    "loop": Option(default="asyncio", type=Choice(LOOPS)),
+})
+
+
+def install_event_loop(loop: str):
+    # should be called before any event loop is created, e.g. before `asyncio.run`
+    if loop == "uvloop":
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    elif loop == "asyncio":
+        asyncio.set_event_loop_policy(None)
+    else:
+        raise ValueError(f"Unknown event loop {loop!r}, expect one of {LOOPS}")
+
+
+@inject
+def install_event_loop_from_config(config):
+    install_event_loop(config.loop)
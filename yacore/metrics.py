@@ -0,0 +1,130 @@
+import bisect
+import math
+from collections.abc import Iterable
+
+from yacore.injector import register
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket where quantile lands
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank and total:
+                return bound
+        return 0.0
+
+
+class MetricsSink:
+
+    def observe(self, name: str, value: float, **labels):
+        pass
+
+    def increment(self, name: str, value: float = 1, **labels):
+        pass
+
+    def set(self, name: str, value: float, **labels):
+        pass
+
+
+class InMemoryMetrics(MetricsSink):
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.histograms: dict[tuple, Histogram] = {}
+        self.counters: dict[tuple, float] = {}
+        self.gauges: dict[tuple, float] = {}
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        self.gauges[_key(name, labels)] = value
+
+    def histogram(self, name: str, **labels) -> Histogram | None:
+        return self.histograms.get(_key(name, labels))
+
+    def counter(self, name: str, **labels) -> float:
+        return self.counters.get(_key(name, labels), 0)
+
+    def gauge(self, name: str, **labels) -> float | None:
+        return self.gauges.get(_key(name, labels))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Iterable[tuple[str, object]]) -> str:
+    rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return f"{{{rendered}}}" if rendered else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class PrometheusMetrics(InMemoryMetrics):
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def render(self) -> str:
+        lines = []
+        for kind, values in (("counter", self.counters), ("gauge", self.gauges)):
+            seen = set()
+            for (name, labels), value in sorted(values.items()):
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        seen = set()
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            total = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                total += count
+                bucket_labels = _format_labels(labels + (("le", _format_value(bound)),))
+                lines.append(f"{name}_bucket{bucket_labels} {total}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        lines.append("")
+        return "\n".join(lines)
+
+
+@register(name="metrics", singleton=True)
+def default_metrics():
+    return PrometheusMetrics()
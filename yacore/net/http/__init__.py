@@ -1,3 +1,17 @@
 # flake8: noqa
-from yacore.net.http.client import NetHttpClient
+from yacore.net.http.client import (
+    NetHttpClient,
+    net_http_client_from_config,
+    net_http_client_options,
+    net_http_clients_from_config,
+)
+from yacore.net.http.breaker import CircuitBreaker, CircuitOpenError
+from yacore.net.http.caching import HttpCache
+from yacore.net.http.compression import CompressionMiddleware
+from yacore.net.http.fanout import AdaptiveLimit, FanOutResult
+from yacore.net.http.limits import ConcurrencyLimiter, ConcurrencyLimitExceededError
+from yacore.net.http.responses import FastJSONResponse, NegotiatedResponse
+from yacore.net.http.retry import HedgePolicy, RetryBudget, RetryPolicy
+from yacore.net.http.routes import NetHttpRoute
 from yacore.net.http.server import NetHttpServer, net_http_server_from_config
+from yacore.net.http.workers import WorkersSupervisor, run_workers_from_config
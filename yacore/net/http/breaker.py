@@ -0,0 +1,120 @@
+import random
+import sys
+import time
+from collections import deque
+from collections.abc import Callable, Sequence
+
+from yarl import URL
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+URL_CACHE_SIZE = 1024
+
+
+class CircuitOpenError(RuntimeError):
+
+    def __init__(self, breaker: "CircuitBreaker"):
+        super().__init__(f"Circuit {breaker.name!r} is open")
+        self.breaker = breaker
+
+
+class CircuitBreaker:
+
+    def __init__(self, name: str = "default", *, failure_rate: float = 0.5, slow_call_duration: float | None = None,
+                 slow_call_rate: float = 0.5, window_size: int = 50, min_requests: int = 10, open_duration: float = 5.0,
+                 half_open_requests: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.min_requests = min_requests
+        self.open_duration = open_duration
+        self.half_open_requests = half_open_requests
+        self.clock = clock
+        self._state = CLOSED
+        # (failed, slow) of last calls
+        self.outcomes: deque[tuple[bool, bool]] = deque(maxlen=window_size)
+        self.opened_at = None
+        self.trials = 0
+        self.successes = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self.clock() - self.opened_at >= self.open_duration:
+            self._state = HALF_OPEN
+            self.trials = self.successes = 0
+        return self._state
+
+    def allows(self) -> bool:
+        state = self.state
+        return state == CLOSED or (state == HALF_OPEN and self.trials < self.half_open_requests)
+
+    def acquire(self):
+        if not self.allows():
+            raise CircuitOpenError(self)
+        if self._state == HALF_OPEN:
+            self.trials += 1
+
+    def release(self):
+        # call was cancelled, so it tells nothing about upstream health
+        if self._state == HALF_OPEN and self.trials > self.successes:
+            self.trials -= 1
+
+    def _open(self):
+        self._state = OPEN
+        self.opened_at = self.clock()
+        self.outcomes.clear()
+
+    def record(self, duration: float, ok: bool):
+        slow = self.slow_call_duration is not None and duration >= self.slow_call_duration
+        if self._state == HALF_OPEN:
+            if not ok or slow:
+                self._open()
+                return
+            self.successes += 1
+            if self.successes >= self.half_open_requests:
+                self._state = CLOSED
+            return
+        if self._state == OPEN:
+            # calls started before circuit was opened
+            return
+        self.outcomes.append((not ok, slow))
+        if len(self.outcomes) < self.min_requests:
+            return
+        failures = sum(failed for failed, _ in self.outcomes)
+        slows = sum(slow for _, slow in self.outcomes)
+        if failures >= self.failure_rate * len(self.outcomes) or \
+                (self.slow_call_duration is not None and slows >= self.slow_call_rate * len(self.outcomes)):
+            self._open()
+
+
+class Upstream:
+
+    def __init__(self, url: URL, breaker: CircuitBreaker | None = None):
+        self.url = url
+        self.breaker = breaker
+        self.in_flight = 0
+        self.urls: dict[str, str] = {}
+
+    def url_for(self, suburl: str) -> str:
+        # yarl joining and quoting is done once per distinct suburl
+        url = self.urls.get(suburl)
+        if url is None:
+            if len(self.urls) >= URL_CACHE_SIZE:
+                self.urls.clear()
+            url = self.urls[suburl] = sys.intern(str(self.url / suburl))
+        return url
+
+
+def pick_upstream(upstreams: Sequence[Upstream]) -> Upstream:
+    if len(upstreams) == 1:
+        return upstreams[0]
+    # hosts with open circuit are ejected, the rest are balanced by "power of two choices" over in-flight requests
+    available = [upstream for upstream in upstreams if upstream.breaker is None or upstream.breaker.allows()]
+    if not available:
+        return upstreams[0]
+    if len(available) == 1:
+        return available[0]
+    first, second = random.sample(available, 2)
+    return first if first.in_flight <= second.in_flight else second
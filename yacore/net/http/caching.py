@@ -0,0 +1,149 @@
+import asyncio
+import email.utils
+import functools
+import logging
+import time
+from collections.abc import Awaitable, Callable, Hashable
+
+import httpx
+
+from yacore.cache import AsyncCache
+from yacore.net.http.headers import parse_cache_control
+
+logger = logging.getLogger(__name__)
+
+# statuses cacheable by default according to rfc 9111, when freshness is given explicitly
+CACHEABLE_STATUSES = frozenset((200, 203, 204, 300, 301, 308, 404, 410))
+
+
+def _seconds(value: str | None) -> float | None:
+    if value is None or not value.isdigit():
+        return None
+    return float(value)
+
+
+def _expires_in(headers: httpx.Headers) -> float | None:
+    try:
+        expires = email.utils.parsedate_to_datetime(headers["expires"])
+        date = email.utils.parsedate_to_datetime(headers["date"]) if "date" in headers else None
+    except (KeyError, TypeError, ValueError):
+        return None
+    if date is None:
+        return max(0.0, expires.timestamp() - time.time())
+    return max(0.0, (expires - date).total_seconds())
+
+
+def freshness(response: httpx.Response) -> tuple[float, float] | None:
+    # (max age, stale while revalidate) or None, if response can't be stored
+    directives = parse_cache_control(response.headers.get("cache-control", ""))
+    if "no-store" in directives or response.headers.get("vary", "").strip() == "*":
+        return None
+    max_age = _seconds(directives.get("max-age"))
+    if max_age is None:
+        max_age = _expires_in(response.headers)
+    has_validators = "etag" in response.headers or "last-modified" in response.headers
+    if max_age is None and not has_validators:
+        return None
+    if "no-cache" in directives:
+        max_age = 0.0
+    max_age = max(0.0, (max_age or 0.0) - (_seconds(response.headers.get("age")) or 0.0))
+    stale = 0.0
+    if "must-revalidate" not in directives:
+        stale = _seconds(directives.get("stale-while-revalidate")) or 0.0
+    return max_age, stale
+
+
+class CachedEntry:
+
+    def __init__(self, response: httpx.Response, stored_at: float, max_age: float, stale: float):
+        self.response = response
+        self.stored_at = stored_at
+        self.max_age = max_age
+        self.stale = stale
+
+    def fresh(self, now: float) -> bool:
+        return now - self.stored_at < self.max_age
+
+    def usable_stale(self, now: float) -> bool:
+        return now - self.stored_at < self.max_age + self.stale
+
+    def conditional_headers(self) -> dict[str, str]:
+        headers = {}
+        if "etag" in self.response.headers:
+            headers["if-none-match"] = self.response.headers["etag"]
+        if "last-modified" in self.response.headers:
+            headers["if-modified-since"] = self.response.headers["last-modified"]
+        return headers
+
+
+class HttpCache:
+
+    def __init__(self, maxsize: int | None = 1024, clock: Callable[[], float] = time.monotonic):
+        # entries are kept after expiration, since stale ones are still useful for revalidation
+        self.entries = AsyncCache(maxsize=maxsize, clock=clock)
+        self.clock = clock
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.coalesced = 0
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _store(self, key: Hashable, entry: CachedEntry | None, response: httpx.Response) -> httpx.Response:
+        now = self.clock()
+        if response.status_code == 304 and entry is not None:
+            self.revalidations += 1
+            if "cache-control" in response.headers or "expires" in response.headers:
+                entry.max_age, entry.stale = freshness(response) or (0.0, 0.0)
+            entry.stored_at = now
+            self.entries.set(key, entry)
+            return entry.response
+        fresh = freshness(response) if response.status_code in CACHEABLE_STATUSES else None
+        if fresh is None:
+            self.entries.delete(key)
+        else:
+            self.entries.set(key, CachedEntry(response, now, *fresh))
+        return response
+
+    async def _fetch(self, key: Hashable, entry: CachedEntry | None, send) -> httpx.Response:
+        response = await send(entry.conditional_headers() if entry is not None else {})
+        return self._store(key, entry, response)
+
+    def _done(self, key: Hashable, future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+
+    def _request(self, key: Hashable, entry: CachedEntry | None, send) -> asyncio.Future:
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future
+        if entry is None:
+            self.misses += 1
+        # request is not bound to the first caller, so its cancellation won't affect the others
+        future = self._in_flight[key] = asyncio.ensure_future(self._fetch(key, entry, send))
+        future.add_done_callback(functools.partial(self._done, key))
+        return future
+
+    @staticmethod
+    def _log_failure(key: Hashable, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning("Background revalidation of %r failed", key, exc_info=future.exception())
+
+    async def fetch(self, key: Hashable, send: Callable[[dict[str, str]], Awaitable[httpx.Response]]):
+        # `send` makes request with given extra conditional headers
+        entry = self.entries.get(key)
+        if entry is not None:
+            now = self.clock()
+            if entry.fresh(now):
+                self.hits += 1
+                return entry.response
+            if entry.usable_stale(now):
+                self.stale_hits += 1
+                if key not in self._in_flight:
+                    self._request(key, entry, send).add_done_callback(functools.partial(self._log_failure, key))
+                return entry.response
+        return await asyncio.shield(self._request(key, entry, send))
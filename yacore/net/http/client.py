@@ -1,42 +1,388 @@
+import asyncio
+import contextlib
+import time
+from collections.abc import AsyncIterable, AsyncIterator, Iterable
+from contextvars import ContextVar
+
+import httpx
 from async_timeout import timeout
+from cock import Option, build_options_from_dict
 from facet import ServiceMixin
 from fastapi.encoders import jsonable_encoder
 from httpx import AsyncClient
 from yarl import URL
 
+from yacore.gather import windowed_gather
+from yacore.injector import inject, register
+from yacore.net.http.breaker import CircuitBreaker, Upstream, pick_upstream
+from yacore.net.http.caching import HttpCache
+from yacore.net.http.fanout import OVERLOAD_STATUSES, AdaptiveLimit, FanOutResult
+from yacore.net.http.retry import HedgePolicy, RetryBudget, RetryPolicy, hedged, with_retries
+from yacore.net.http.serialization import CONTENT_FORMATS, json_dumps, media_type_format
+from yacore.net.http.streaming import STREAM_CHUNK_SIZE, STREAM_DECODERS, encode_stream, media_type_stream_format
+
+net_http_client_options = build_options_from_dict({
+    "net-http-client": {
+        "host": Option(default="localhost"),
+        "port": Option(default=80, type=int),
+        "scheme": Option(default="http"),
+        # additional clients sharing all other options, "name=scheme://host:port", e.g. "billing=http://billing:8080"
+        "named": Option(default=(), multiple=True),
+        # whole request deadline, including retries and waiting for pool connection
+        "timeout": Option(default=600.0, type=float),
+        "connect_timeout": Option(default=5.0, type=float),
+        "read_timeout": Option(default=5.0, type=float),
+        "write_timeout": Option(default=5.0, type=float),
+        "pool_timeout": Option(default=5.0, type=float),
+        "max_connections": Option(default=100, type=int),
+        "max_keepalive_connections": Option(default=20, type=int),
+        "keepalive_expiry": Option(default=5.0, type=float),
+        # tls connections negotiate http/2 via alpn, plain ones use h2c with prior knowledge
+        "http2": Option(default=False, type=bool),
+        "unpack_json": Option(default=False, type=bool),
+        "raise_for_status": Option(default=False, type=bool),
+        "content_format": Option(default="json"),
+        # encode json bodies straight to bytes, `jsonable_encoder` is called only for types json library can't handle
+        "fast_json": Option(default=True, type=bool),
+        # retries of idempotent requests with jittered exponential backoff, 1 attempt disables them
+        "retry_attempts": Option(default=1, type=int),
+        "retry_backoff": Option(default=0.05, type=float),
+        "retry_backoff_max": Option(default=2.0, type=float),
+        "retry_statuses": Option(default=(502, 503, 504), type=int, multiple=True),
+        # retries and hedges are limited to this fraction of requests
+        "retry_budget_ratio": Option(default=0.2, type=float),
+        # duplicate idempotent request is sent after fixed delay or observed latency quantile, e.g. 0.95
+        "hedge_delay": Option(default=None, type=float),
+        "hedge_quantile": Option(default=None, type=float),
+        # get responses cache following upstream cache-control and validators, 0 disables it
+        "cache_size": Option(default=0, type=int),
+        # additional upstreams of the same service, "host:port", requests are balanced over all of them
+        "hosts": Option(default=(), multiple=True),
+        # per host circuit breaker, hosts with open circuit are ejected from balancing
+        "circuit_breaker": Option(default=False, type=bool),
+        "circuit_breaker_failure_rate": Option(default=0.5, type=float),
+        "circuit_breaker_slow_call_duration": Option(default=None, type=float),
+        "circuit_breaker_slow_call_rate": Option(default=0.5, type=float),
+        "circuit_breaker_window_size": Option(default=50, type=int),
+        "circuit_breaker_min_requests": Option(default=10, type=int),
+        "circuit_breaker_open_duration": Option(default=5.0, type=float),
+    },
+})
+
+# `httpx.AsyncClient.request` arguments, which are not part of request itself
+_SEND_OPTIONS = frozenset(("auth", "follow_redirects"))
+_JSON_HEADERS = {"content-type": "application/json"}
+# loop time of current request timeout, so `_call` can tell timeout from cancellation of e.g. lost hedge
+_DEADLINE: ContextVar[float | None] = ContextVar("yacore_net_http_client_deadline", default=None)
+
+
+def encode_json(value) -> bytes:
+    return json_dumps(value, default=jsonable_encoder)
+
+
+@contextlib.asynccontextmanager
+async def _request_timeout(delay: float | None):
+    async with timeout(delay) as deadline:
+        token = _DEADLINE.set(deadline.deadline)
+        try:
+            yield
+        finally:
+            _DEADLINE.reset(token)
+
 
 class NetHttpClient(ServiceMixin):
 
-    def __init__(self, host, port=80, timeout=600.0, scheme="http", unpack_json=False, raise_for_status=False):
+    def __init__(self, host, port=80, timeout=600.0, scheme="http", unpack_json=False, raise_for_status=False,
+                 content_format="json", *, connect_timeout=5.0, read_timeout=5.0, write_timeout=5.0, pool_timeout=5.0,
+                 max_connections=100, max_keepalive_connections=20, keepalive_expiry=5.0, http2=False,
+                 retry: RetryPolicy | None = None, hedge: HedgePolicy | None = None,
+                 retry_budget: RetryBudget | None = None, cache: HttpCache | None = None, hosts=(),
+                 breaker_options: dict | None = None, fast_json=True,
+                 transport: httpx.AsyncBaseTransport | None = None):
         self.base_url = URL.build(scheme=scheme, host=host, port=port)
+        self.upstreams = []
+        for url in [self.base_url, *(URL(f"{scheme}://{address}") for address in hosts)]:
+            breaker = None if breaker_options is None else CircuitBreaker(f"{url.host}:{url.port}", **breaker_options)
+            self.upstreams.append(Upstream(url, breaker))
         self.timeout = timeout
+        self.transport_timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=write_timeout,
+            pool=pool_timeout,
+        )
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2
         self.unpack_json = unpack_json
         self.raise_for_status = raise_for_status
+        if content_format not in CONTENT_FORMATS:
+            raise ValueError(f"Unknown content format {content_format!r}, expect one of {list(CONTENT_FORMATS)}")
+        self.content_format = content_format
+        self.fast_json = fast_json
+        self.transport = transport
+        self.retry = retry
+        self.hedge = hedge
+        self.retry_budget = retry_budget or RetryBudget()
+        self.cache = cache
         self.client = None
 
     async def start(self):
-        self.client = AsyncClient()
+        self.client = AsyncClient(
+            timeout=self.transport_timeout,
+            limits=self.limits,
+            http1=not (self.http2 and self.base_url.scheme == "http"),
+            http2=self.http2,
+            transport=self.transport,
+        )
         return self
 
     async def stop(self):
         await self.client.aclose()
 
-    async def request(self, suburl: str, method: str = "POST", raw=False, json=None, **extra):
-        url = self.base_url / suburl
+    def _binary_request(self, format: str, json, extra: dict) -> dict:
+        # payload is sent in binary format, server falls back to json response if it does not support it
+        media_type, dumps, _ = CONTENT_FORMATS[format]
+        headers = {"accept": f"{media_type}, application/json;q=0.5", **extra.pop("headers", {})}
         if json is not None:
-            json = jsonable_encoder(json)
-        async with timeout(self.timeout):
-            response = await self.client.request(method, str(url), json=json, **extra)
-            if raw:
-                return response
-            if self.raise_for_status:
-                response.raise_for_status()
-            if not self.unpack_json:
-                return response
+            headers["content-type"] = media_type
+            extra["content"] = dumps(json, default=jsonable_encoder)
+        return dict(headers=headers, **extra)
+
+    @staticmethod
+    def unpack(response):
+        format = media_type_format(response.headers.get("content-type", ""))
+        if format is None or format == "json":
             return response.json()
+        _, _, loads = CONTENT_FORMATS[format]
+        return loads(response.content)
+
+    def _handle_response(self, response: httpx.Response, raw: bool):
+        if raw:
+            return response
+        if self.raise_for_status:
+            response.raise_for_status()
+        if not self.unpack_json:
+            return response
+        return self.unpack(response)
+
+    async def _call(self, method: str, suburl: str, extra: dict, stream: bool = False) -> httpx.Response:
+        upstream = pick_upstream(self.upstreams)
+        send_options = {"stream": stream}
+        if not _SEND_OPTIONS.isdisjoint(extra):
+            extra = dict(extra)
+            send_options.update((key, extra.pop(key)) for key in _SEND_OPTIONS & extra.keys())
+        request = self.client.build_request(method, upstream.url_for(suburl), **extra)
+        breaker = upstream.breaker
+        if breaker is None:
+            return await self.client.send(request, **send_options)
+        breaker.acquire()
+        upstream.in_flight += 1
+        started = time.monotonic()
+        ok = False
+        try:
+            response = await self.client.send(request, **send_options)
+            ok = response.status_code < 500
+            return response
+        except asyncio.CancelledError:
+            deadline = _DEADLINE.get()
+            # hung upstream is a failure, but cancelled call tells nothing about upstream health
+            if deadline is None or asyncio.get_running_loop().time() < deadline:
+                breaker.release()
+                started = None
+            raise
+        finally:
+            upstream.in_flight -= 1
+            if started is not None:
+                breaker.record(time.monotonic() - started, ok)
+
+    def _send(self, method: str, suburl: str, extra: dict, retry, hedge):
+        def send():
+            return self._call(method, suburl, extra)
+
+        self.retry_budget.deposit()
+        # explicit `False` disables client policy for single request
+        retry = self.retry if retry is None else retry
+        hedge = self.hedge if hedge is None else hedge
+        if hedge and method in hedge.methods:
+            hedge_send = send
+
+            def send():
+                return hedged(hedge_send, hedge, self.retry_budget)
+        if retry and method in retry.methods:
+            return with_retries(send, retry, self.retry_budget)
+        return send()
+
+    @staticmethod
+    def _cache_key(url: str, extra: dict) -> tuple:
+        headers = httpx.Headers(extra.get("headers"))
+        return url, str(httpx.QueryParams(extra.get("params"))), tuple(sorted(headers.multi_items()))
+
+    def _cached_send(self, suburl: str, extra: dict, retry, hedge):
+        def send(conditional: dict[str, str]):
+            headers = {**httpx.Headers(extra.get("headers")), **conditional}
+            return self._send("GET", suburl, {**extra, "headers": headers}, retry, hedge)
+
+        return self.cache.fetch(self._cache_key(self.upstreams[0].url_for(suburl), extra), send)
+
+    def _encode_body(self, json, content_format: str | None, extra: dict) -> dict:
+        content_format = content_format or self.content_format
+        if content_format != "json":
+            return self._binary_request(content_format, json, extra)
+        if json is None:
+            return extra
+        if not self.fast_json:
+            extra["json"] = jsonable_encoder(json)
+            return extra
+        extra["content"] = encode_json(json)
+        headers = extra.get("headers")
+        extra["headers"] = _JSON_HEADERS if headers is None else {**_JSON_HEADERS, **httpx.Headers(headers)}
+        return extra
+
+    async def request(self, suburl: str, method: str = "POST", raw=False, json=None, content_format=None,
+                      retry: RetryPolicy | None = None, hedge: HedgePolicy | None = None, cache=True, **extra):
+        extra = self._encode_body(json, content_format, extra)
+        async with _request_timeout(self.timeout):
+            if cache and self.cache is not None and method == "GET":
+                response = await self._cached_send(suburl, extra, retry, hedge)
+            else:
+                response = await self._send(method, suburl, extra, retry, hedge)
+            return self._handle_response(response, raw)
 
     async def get(self, suburl: str, **extra):
         return await self.request(suburl, method="GET", **extra)
 
     async def post(self, suburl: str, **extra):
         return await self.request(suburl, method="POST", **extra)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, suburl: str, method: str = "GET", json=None, content_format=None,
+                     **extra) -> AsyncIterator[httpx.Response]:
+        # response body is not read, timeout applies to receiving headers only
+        extra = self._encode_body(json, content_format, extra)
+        async with _request_timeout(self.timeout):
+            response = await self._call(method, suburl, extra, stream=True)
+        try:
+            if self.raise_for_status:
+                response.raise_for_status()
+            yield response
+        finally:
+            await response.aclose()
+
+    async def iter_bytes(self, suburl: str, method: str = "GET", chunk_size: int | None = None,
+                         **extra) -> AsyncIterator[bytes]:
+        async with self.stream(suburl, method, **extra) as response:
+            async for chunk in response.aiter_bytes(chunk_size):
+                yield chunk
+
+    async def iter_items(self, suburl: str, method: str = "GET", format: str | None = None,
+                         **extra) -> AsyncIterator:
+        # ndjson or json array items are decoded as they arrive, format is taken from content type by default
+        async with self.stream(suburl, method, **extra) as response:
+            format = format or media_type_stream_format(response.headers.get("content-type", ""))
+            if format not in STREAM_DECODERS:
+                raise ValueError(f"Can't decode stream of {response.headers.get('content-type')!r}, "
+                                 f"expect one of {list(STREAM_DECODERS)} formats")
+            async for item in STREAM_DECODERS[format](response.aiter_bytes()):
+                yield item
+
+    async def upload(self, suburl: str, items: AsyncIterable, format: str = "ndjson", method: str = "POST", *,
+                     chunk_size: int = STREAM_CHUNK_SIZE, **extra):
+        # generator body can't be sent twice, so retries and hedging are disabled
+        content, media_type = encode_stream(items, format, chunk_size=chunk_size)
+        headers = {"content-type": media_type, **extra.pop("headers", {})}
+        return await self.request(suburl, method, content=content, headers=headers, retry=False, hedge=False,
+                                  content_format="json", **extra)
+
+    async def _fan_out_call(self, index: int, item: str | dict, limit: AdaptiveLimit | None) -> FanOutResult:
+        item = {"suburl": item, "method": "GET"} if isinstance(item, str) else dict(item)
+        raw = item.pop("raw", False)
+        status = None
+        started = time.monotonic()
+        try:
+            # status is checked before response is raised for or unpacked
+            response = await self.request(raw=True, **item)
+            status = response.status_code
+            result = FanOutResult(index, value=self._handle_response(response, raw))
+        except Exception as e:
+            result = FanOutResult(index, error=e)
+        if limit is not None:
+            limit.observe(time.monotonic() - started, ok=result.ok and status not in OVERLOAD_STATUSES)
+        return result
+
+    def fan_out(self, requests: Iterable[str | dict], concurrency: int = 16, *, ordered: bool = False,
+                adaptive: bool = False, max_concurrency: int | None = None) -> AsyncIterator[FanOutResult]:
+        # items are get suburls or `request` keyword arguments, errors are returned within results
+        limit = AdaptiveLimit(concurrency, max_limit=max_concurrency) if adaptive else None
+        calls = (self._fan_out_call(index, item, limit) for index, item in enumerate(requests))
+        return windowed_gather(calls, concurrency if limit is None else lambda: limit.window, ordered)
+
+
+def _client_from_config(config, url: URL | None = None) -> NetHttpClient:
+    retry = hedge = None
+    if config.net_http_client_retry_attempts > 1:
+        retry = RetryPolicy(
+            config.net_http_client_retry_attempts,
+            backoff=config.net_http_client_retry_backoff,
+            backoff_max=config.net_http_client_retry_backoff_max,
+            statuses=config.net_http_client_retry_statuses,
+        )
+    if config.net_http_client_hedge_delay is not None or config.net_http_client_hedge_quantile is not None:
+        hedge = HedgePolicy(config.net_http_client_hedge_quantile, delay=config.net_http_client_hedge_delay)
+    breaker_options = None
+    if config.net_http_client_circuit_breaker:
+        breaker_options = dict(
+            failure_rate=config.net_http_client_circuit_breaker_failure_rate,
+            slow_call_duration=config.net_http_client_circuit_breaker_slow_call_duration,
+            slow_call_rate=config.net_http_client_circuit_breaker_slow_call_rate,
+            window_size=config.net_http_client_circuit_breaker_window_size,
+            min_requests=config.net_http_client_circuit_breaker_min_requests,
+            open_duration=config.net_http_client_circuit_breaker_open_duration,
+        )
+    hosts = config.net_http_client_hosts if url is None else ()
+    if url is None:
+        url = URL.build(scheme=config.net_http_client_scheme, host=config.net_http_client_host,
+                        port=config.net_http_client_port)
+    return NetHttpClient(
+        host=url.host,
+        port=url.port,
+        scheme=url.scheme,
+        timeout=config.net_http_client_timeout,
+        unpack_json=config.net_http_client_unpack_json,
+        raise_for_status=config.net_http_client_raise_for_status,
+        content_format=config.net_http_client_content_format,
+        fast_json=config.net_http_client_fast_json,
+        connect_timeout=config.net_http_client_connect_timeout,
+        read_timeout=config.net_http_client_read_timeout,
+        write_timeout=config.net_http_client_write_timeout,
+        pool_timeout=config.net_http_client_pool_timeout,
+        max_connections=config.net_http_client_max_connections,
+        max_keepalive_connections=config.net_http_client_max_keepalive_connections,
+        keepalive_expiry=config.net_http_client_keepalive_expiry,
+        http2=config.net_http_client_http2,
+        retry=retry,
+        hedge=hedge,
+        retry_budget=RetryBudget(config.net_http_client_retry_budget_ratio),
+        cache=HttpCache(config.net_http_client_cache_size) if config.net_http_client_cache_size > 0 else None,
+        hosts=hosts,
+        breaker_options=breaker_options,
+    )
+
+
+@register(name="net_http_client", singleton=True)
+@inject
+def net_http_client_from_config(config):
+    return _client_from_config(config)
+
+
+@register(name="net_http_clients", singleton=True)
+@inject
+def net_http_clients_from_config(config) -> dict[str, NetHttpClient]:
+    clients = {}
+    for spec in config.net_http_client_named:
+        name, _, url = spec.partition("=")
+        clients[name] = _client_from_config(config, URL(url))
+    return clients
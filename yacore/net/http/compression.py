@@ -0,0 +1,129 @@
+import gzip
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from yacore.net.http.headers import parse_quality_values
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+DEFAULT_CONTENT_TYPES = ("application/json", "application/x-ndjson", "application/msgpack", "text/")
+DEFAULT_LEVELS = {"zstd": 3, "br": 4, "gzip": 6}
+
+
+def _gzip(body: bytes, level: int) -> bytes:
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def _brotli(body: bytes, level: int) -> bytes:
+    return brotli.compress(body, quality=level)
+
+
+def _zstd(body: bytes, level: int) -> bytes:
+    return zstandard.ZstdCompressor(level=level).compress(body)
+
+
+# module level functions, so they can be sent to process cpu pool
+COMPRESSORS = {"gzip": _gzip}
+if brotli is not None:
+    COMPRESSORS["br"] = _brotli
+if zstandard is not None:
+    COMPRESSORS["zstd"] = _zstd
+
+
+def parse_compression_levels(specs) -> dict[str, dict[str, int]]:
+    # "content/type:encoding:level", e.g. "application/json:br:5"
+    levels = {}
+    for spec in specs:
+        content_type, encoding, level = spec.rsplit(":", 2)
+        levels.setdefault(content_type, {})[encoding] = int(level)
+    return levels
+
+
+class CompressionMiddleware:
+
+    def __init__(self, app, *, encodings=("zstd", "br", "gzip"), min_size=1024, content_types=DEFAULT_CONTENT_TYPES,
+                 levels: dict[str, dict[str, int]] | None = None, executors=None, offload_size: int | None = None,
+                 pool="cpu"):
+        unknown = set(encodings) - set(DEFAULT_LEVELS)
+        if unknown:
+            raise ValueError(f"Unknown compression encodings {sorted(unknown)}, expect some of {list(DEFAULT_LEVELS)}")
+        self.app = app
+        # server preference order, encodings with missing library are skipped
+        self.encodings = [encoding for encoding in encodings if encoding in COMPRESSORS]
+        self.min_size = min_size
+        self.content_types = tuple(content_types)
+        self.levels = levels or {}
+        self.executors = executors
+        self.offload_size = offload_size
+        self.pool = pool
+
+    def negotiate(self, header: str) -> str | None:
+        weights = parse_quality_values(header)
+        default = weights.get("*", 0.0)
+        best, best_weight = None, 0.0
+        for encoding in self.encodings:
+            weight = weights.get(encoding, default)
+            if weight > best_weight:
+                best, best_weight = encoding, weight
+        return best
+
+    def level(self, content_type: str, encoding: str) -> int | None:
+        content_type = content_type.partition(";")[0].strip().lower()
+        levels = self.levels.get(content_type)
+        if levels is not None:
+            return levels.get(encoding, DEFAULT_LEVELS[encoding])
+        for allowed in self.content_types:
+            if content_type == allowed or (allowed.endswith("/") and content_type.startswith(allowed)):
+                return DEFAULT_LEVELS[encoding]
+        return None
+
+    async def compress(self, encoding: str, body: bytes, level: int) -> bytes:
+        compressor = COMPRESSORS[encoding]
+        if self.executors is not None and self.offload_size is not None and len(body) >= self.offload_size:
+            # big bodies would block event loop for milliseconds
+            return await self.executors.call(self.pool, compressor, body, level)
+        return compressor(body, level)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = self.negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        start = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if passthrough:
+                return await send(message)
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                return await send(message)
+            passthrough = True
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            # streaming bodies and already encoded ones are sent as is
+            level = None
+            if not message.get("more_body", False) and len(body) >= self.min_size and \
+                    "content-encoding" not in headers:
+                level = self.level(headers.get("content-type", ""), encoding)
+            if level is not None:
+                body = await self.compress(encoding, body, level)
+                headers["content-encoding"] = encoding
+                headers["content-length"] = str(len(body))
+                headers.add_vary_header("accept-encoding")
+                message = {**message, "body": body}
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,48 @@
+import math
+from dataclasses import dataclass
+from typing import Any
+
+OVERLOAD_STATUSES = frozenset((429, 503))
+
+
+@dataclass(frozen=True)
+class FanOutResult:
+    index: int
+    value: Any = None
+    error: BaseException | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class AdaptiveLimit:
+
+    def __init__(self, initial: int, *, min_limit: int = 1, max_limit: int | None = None, tolerance: float = 2.0,
+                 smoothing: float = 0.2, backoff: float = 0.9):
+        # gradient limit: grows while latency stays near the best observed one, shrinks when requests queue upstream
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit or initial * 4
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self.min_latency = None
+        self.latency = None
+
+    @property
+    def window(self) -> int:
+        return int(self.limit)
+
+    def observe(self, latency: float, ok: bool = True):
+        if not ok:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            return
+        self.min_latency = latency if self.min_latency is None else min(self.min_latency, latency)
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+        gradient = max(0.5, min(1.0, self.tolerance * self.min_latency / max(self.latency, 1e-9)))
+        limit = self.limit * gradient + math.sqrt(self.limit)
+        self.limit = max(self.min_limit, min(self.max_limit, limit))
@@ -0,0 +1,28 @@
+def parse_quality_values(header: str) -> dict[str, float]:
+    # "gzip, br;q=0.5" -> {"gzip": 1.0, "br": 0.5}
+    weights = {}
+    for item in header.split(","):
+        name, *params = item.strip().split(";")
+        weight = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        name = name.strip().lower()
+        if name:
+            weights[name] = weight
+    return weights
+
+
+def parse_cache_control(header: str) -> dict[str, str | None]:
+    # "max-age=60, no-cache" -> {"max-age": "60", "no-cache": None}
+    directives = {}
+    for item in header.split(","):
+        name, sep, value = item.strip().partition("=")
+        name = name.strip().lower()
+        if name:
+            directives[name] = value.strip().strip('"') if sep else None
+    return directives
@@ -0,0 +1,113 @@
+import asyncio
+from collections import deque
+
+from yacore.metrics import MetricsSink
+from yacore.net.http.responses import api_error
+
+SHED_METRIC = "yacore_http_shed_total"
+QUEUED_METRIC = "yacore_http_limiter_queued"
+
+
+class ConcurrencyLimitExceededError(RuntimeError):
+
+    def __init__(self, limiter: "ConcurrencyLimiter", reason: str):
+        super().__init__(f"Concurrency limit of {limiter.name!r} exceeded ({reason})")
+        self.limiter = limiter
+        self.reason = reason
+
+
+class ConcurrencyLimiter:
+
+    def __init__(self, limit: int, *, max_queue: int = 0, queue_timeout: float | None = None, name: str = "global",
+                 status_code: int = 503, retry_after: int = 1, metrics: MetricsSink | None = None):
+        if limit < 1:
+            raise ValueError(f"Concurrency limit should be positive, got {limit}")
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.name = name
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.metrics = metrics or MetricsSink()
+        self.running = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _reject(self, reason: str):
+        self.metrics.increment(SHED_METRIC, limiter=self.name, reason=reason)
+        return ConcurrencyLimitExceededError(self, reason)
+
+    async def acquire(self):
+        if self.running < self.limit and not self._waiters:
+            self.running += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject("queue_full")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.metrics.set(QUEUED_METRIC, len(self._waiters), limiter=self.name)
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                await waiter
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # slot was handed over right before timeout or cancellation
+                self.release()
+            else:
+                waiter.cancel()
+                # `release` may have already dropped cancelled waiter
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                self.metrics.set(QUEUED_METRIC, len(self._waiters), limiter=self.name)
+            if isinstance(e, TimeoutError):
+                raise self._reject("queue_timeout") from None
+            raise
+
+    def release(self):
+        # slot goes to the first waiter directly, so newcomers can't overtake the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            self.metrics.set(QUEUED_METRIC, len(self._waiters), limiter=self.name)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def rejection_response(self, exc: ConcurrencyLimitExceededError):
+        return api_error(
+            status_code=self.status_code,
+            code="common.overloaded",
+            message=str(exc),
+            data={"reason": exc.reason},
+            headers={"retry-after": str(self.retry_after)},
+        )
+
+
+class ConcurrencyLimitMiddleware:
+
+    def __init__(self, app, limiter: ConcurrencyLimiter, exempt_paths=()):
+        self.app = app
+        self.limiter = limiter
+        self.exempt_paths = frozenset(exempt_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            return await self.app(scope, receive, send)
+        try:
+            await self.limiter.acquire()
+        except ConcurrencyLimitExceededError as e:
+            return await self.limiter.rejection_response(e)(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release()
@@ -0,0 +1,60 @@
+import time
+
+from yacore.metrics import MetricsSink
+
+REQUEST_DURATION_METRIC = "yacore_http_request_duration_seconds"
+REQUESTS_METRIC = "yacore_http_requests_total"
+REQUEST_SIZE_METRIC = "yacore_http_request_size_bytes_total"
+RESPONSE_SIZE_METRIC = "yacore_http_response_size_bytes_total"
+IN_FLIGHT_METRIC = "yacore_http_requests_in_flight"
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def route_label(scope) -> str:
+    # templated path, so "/items/{id}" does not produce label per item
+    return getattr(scope.get("route"), "path", None) or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+
+    def __init__(self, app, metrics: MetricsSink):
+        self.app = app
+        self.metrics = metrics
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = 500
+        request_size = 0
+        response_size = 0
+
+        async def receive_wrapper():
+            nonlocal request_size
+            message = await receive()
+            request_size += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status, response_size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        self.in_flight += 1
+        self.metrics.set(IN_FLIGHT_METRIC, self.in_flight)
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            self.in_flight -= 1
+            self.metrics.set(IN_FLIGHT_METRIC, self.in_flight)
+            method = scope["method"]
+            route = route_label(scope)
+            self.metrics.observe(REQUEST_DURATION_METRIC, time.perf_counter() - started, method=method, route=route)
+            self.metrics.increment(REQUESTS_METRIC, method=method, route=route, status=status)
+            self.metrics.increment(REQUEST_SIZE_METRIC, request_size, method=method, route=route)
+            self.metrics.increment(RESPONSE_SIZE_METRIC, response_size, method=method, route=route)
@@ -0,0 +1,49 @@
+from contextvars import ContextVar
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from yacore.net.http.serialization import CONTENT_FORMATS, json_dumps
+
+# format negotiated for request being served, set by `NetHttpRoute`
+RESPONSE_FORMAT: ContextVar[str] = ContextVar("yacore_net_http_response_format", default="json")
+
+
+def _json_default(value):
+    # raw request body ends up in validation errors, it may be binary
+    if isinstance(value, bytes | bytearray | memoryview):
+        return bytes(value).decode(errors="replace")
+    return jsonable_encoder(value)
+
+
+class FastJSONResponse(JSONResponse):
+
+    def render(self, content: Any) -> bytes:
+        # bytes are treated as already serialized json
+        if isinstance(content, bytes | bytearray | memoryview):
+            return bytes(content)
+        return json_dumps(content, default=_json_default)
+
+
+class NegotiatedResponse(FastJSONResponse):
+
+    def render(self, content: Any) -> bytes:
+        format = RESPONSE_FORMAT.get()
+        if format == "json" or isinstance(content, bytes | bytearray | memoryview):
+            return super().render(content)
+        self.media_type, dumps, _ = CONTENT_FORMATS[format]
+        return dumps(content, default=jsonable_encoder)
+
+
+def api_error(status_code: int, code: str, message: str | None = None, data: Any | None = None,
+              headers: dict[str, str] | None = None):
+    return FastJSONResponse(
+        status_code=status_code,
+        headers=headers,
+        content={
+            "code": code,
+            "message": message,
+            "data": data,
+        },
+    )
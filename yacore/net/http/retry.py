@@ -0,0 +1,158 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+import httpx
+
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+RETRY_STATUSES = frozenset((502, 503, 504))
+
+
+class RetryBudget:
+
+    def __init__(self, ratio: float = 0.2, min_tokens: float = 10.0, max_tokens: float = 100.0):
+        # every request deposits `ratio` tokens, every retry or hedge withdraws one, so extra load
+        # is bounded by `ratio` of normal traffic and can't amplify an outage
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = min_tokens
+        self.retries = 0
+        self.hedges = 0
+        self.exhausted = 0
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RetryPolicy:
+
+    def __init__(self, attempts: int = 3, *, backoff: float = 0.05, backoff_max: float = 2.0,
+                 statuses=RETRY_STATUSES, methods=IDEMPOTENT_METHODS):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.statuses = frozenset(statuses)
+        self.methods = frozenset(methods)
+
+    def delay(self, attempt: int, response: httpx.Response | None = None) -> float:
+        # "full jitter" exponential backoff, retries of many clients do not come in waves
+        delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, min(self.backoff_max, float(retry_after)))
+        return delay
+
+
+class LatencyTracker:
+
+    def __init__(self, size: int = 1000, refresh: int = 100):
+        self.samples = deque(maxlen=size)
+        self.refresh = refresh
+        self._sorted = []
+        self._added = 0
+
+    def observe(self, value: float):
+        self.samples.append(value)
+        self._added += 1
+        # sorting full window on every observation is too expensive for hot path
+        if self._added >= self.refresh or len(self.samples) <= self.refresh:
+            self._sorted = sorted(self.samples)
+            self._added = 0
+
+    def quantile(self, q: float) -> float | None:
+        if not self._sorted:
+            return None
+        return self._sorted[min(len(self._sorted) - 1, int(q * len(self._sorted)))]
+
+
+class HedgePolicy:
+
+    def __init__(self, quantile: float | None = 0.95, *, delay: float | None = None, min_delay: float = 0.005,
+                 min_samples: int = 20, methods=IDEMPOTENT_METHODS):
+        if quantile is None and delay is None:
+            raise ValueError("Hedge policy requires 'quantile' or 'delay'")
+        self.quantile = quantile
+        self.fixed_delay = delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.methods = frozenset(methods)
+        self.latency = LatencyTracker()
+
+    def delay(self) -> float | None:
+        # duplicate request is sent when the first one is slower than usual
+        if self.fixed_delay is not None:
+            return self.fixed_delay
+        if len(self.latency.samples) < self.min_samples:
+            return None
+        return max(self.min_delay, self.latency.quantile(self.quantile))
+
+
+async def _first_success(tasks: set[asyncio.Task]):
+    error = None
+    try:
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def hedged(send, policy: HedgePolicy, budget: RetryBudget):
+    started = time.monotonic()
+
+    async def attempt():
+        response = await send()
+        policy.latency.observe(time.monotonic() - started)
+        return response
+
+    delay = policy.delay()
+    if delay is None:
+        return await attempt()
+    first = asyncio.ensure_future(attempt())
+    try:
+        await asyncio.wait_for(asyncio.shield(first), delay)
+    except TimeoutError:
+        pass
+    except BaseException:
+        first.cancel()
+        raise
+    if first.done() or not budget.withdraw():
+        return await first
+    budget.hedges += 1
+
+    async def hedge():
+        hedge_started = time.monotonic()
+        response = await send()
+        policy.latency.observe(time.monotonic() - hedge_started)
+        return response
+
+    return await _first_success({first, asyncio.ensure_future(hedge())})
+
+
+async def with_retries(send, policy: RetryPolicy, budget: RetryBudget):
+    for attempt in range(policy.attempts):
+        last = attempt == policy.attempts - 1
+        try:
+            response = await send()
+        except httpx.TransportError:
+            if last or not budget.withdraw():
+                raise
+            response = None
+        else:
+            if response.status_code not in policy.statuses or last or not budget.withdraw():
+                return response
+        budget.retries += 1
+        await asyncio.sleep(policy.delay(attempt, response))
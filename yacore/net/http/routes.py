@@ -0,0 +1,173 @@
+import hashlib
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+
+from fastapi.routing import APIRoute
+from starlette.requests import Request
+from starlette.responses import Response
+
+from yacore.cache import AsyncCache
+from yacore.net.http.limits import ConcurrencyLimiter, ConcurrencyLimitExceededError
+from yacore.net.http.responses import RESPONSE_FORMAT
+from yacore.net.http.serialization import CONTENT_FORMATS, json_loads, media_type_format, negotiate_format
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    status_code: int
+    raw_headers: list[tuple[bytes, bytes]]
+    body: bytes
+    etag: str
+
+
+def default_cache_key(request: Request) -> Hashable:
+    return tuple(sorted(request.query_params.multi_items()))
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag in tags
+
+
+def _not_modified(cached: CachedResponse) -> Response:
+    return Response(status_code=304, headers={"etag": cached.etag})
+
+
+def _replay(cached: CachedResponse) -> Response:
+    response = Response(status_code=cached.status_code)
+    response.body = cached.body
+    response.raw_headers = list(cached.raw_headers)
+    return response
+
+
+class DecodedRequest(Request):
+
+    def __init__(self, request: Request, format: str):
+        # fastapi parses body only for json content type, decoded body is given via `json` method
+        headers = [(k, v) for k, v in request.scope["headers"] if k != b"content-type"]
+        headers.append((b"content-type", b"application/json"))
+        super().__init__({**request.scope, "headers": headers}, request.receive)
+        self.format = format
+
+    async def json(self):
+        if not hasattr(self, "_json"):
+            _, _, loads = CONTENT_FORMATS[self.format]
+            self._json = loads(await self.body())
+        return self._json
+
+
+def _transcode(response: Response, format: str) -> Response:
+    # typed endpoints are serialized straight to json bytes by fastapi
+    if format == "json" or response.media_type != "application/json" or not hasattr(response, "body"):
+        return response
+    media_type, dumps, _ = CONTENT_FORMATS[format]
+    response.body = dumps(json_loads(response.body))
+    response.headers["content-type"] = media_type
+    response.headers["content-length"] = str(len(response.body))
+    return response
+
+
+class NetHttpRoute(APIRoute):
+
+    def __init__(self, *args, response_cache: AsyncCache | None = None, cache_ttl: float | None = None,
+                 cache_key: Callable[[Request], Hashable] | None = None,
+                 concurrency_limiter: ConcurrencyLimiter | None = None, content_formats=("json",), **kwargs):
+        # handler is built in base class constructor
+        self.content_formats = frozenset(content_formats)
+        self.concurrency_limiter = concurrency_limiter
+        self.response_cache = response_cache
+        self.cache_ttl = cache_ttl
+        self.cache_key = cache_key or default_cache_key
+        super().__init__(*args, **kwargs)
+        if response_cache is not None and self.dependant.dependencies:
+            # cache hits skip dependencies, e.g. authorization would be bypassed
+            raise ValueError(f"Route {self.path!r} with dependencies can't use response cache")
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        if self.concurrency_limiter is not None:
+            handler = self._limited_handler(handler)
+        if self.content_formats != {"json"}:
+            handler = self._negotiated_handler(handler)
+        # cache hits do not occupy concurrency slots
+        if self.response_cache is not None:
+            handler = self._cached_handler(handler)
+        return handler
+
+    def _limited_handler(self, handler):
+        limiter = self.concurrency_limiter
+
+        async def limited_handler(request: Request) -> Response:
+            try:
+                await limiter.acquire()
+            except ConcurrencyLimitExceededError as e:
+                return limiter.rejection_response(e)
+            try:
+                response = await handler(request)
+            except BaseException:
+                limiter.release()
+                raise
+            # streaming body is produced while response is sent, after handler returns,
+            # so slot is released with fastapi request stack, which is closed when response is sent
+            stack = request.scope.get("fastapi_inner_astack")
+            if stack is None or hasattr(response, "body"):
+                limiter.release()
+            else:
+                stack.callback(limiter.release)
+            return response
+
+        return limited_handler
+
+    def _negotiated_handler(self, handler):
+        formats = self.content_formats
+
+        async def negotiated_handler(request: Request) -> Response:
+            request_format = media_type_format(request.headers.get("content-type", ""))
+            if request_format is not None and request_format != "json" and request_format in formats:
+                request = DecodedRequest(request, request_format)
+            format = negotiate_format(request.headers.get("accept", ""), formats)
+            token = RESPONSE_FORMAT.set(format)
+            try:
+                response = await handler(request)
+            finally:
+                RESPONSE_FORMAT.reset(token)
+            response.headers.add_vary_header("accept")
+            return _transcode(response, format)
+
+        return negotiated_handler
+
+    def _cached_handler(self, handler):
+        cache = self.response_cache
+
+        async def cached_handler(request: Request) -> Response:
+            format = negotiate_format(request.headers.get("accept", ""), self.content_formats)
+            # request headers are not part of the key, `cache_key` should add ones response depends on
+            key = request.url.path, format, self.cache_key(request)
+            response = None
+
+            async def compute() -> CachedResponse | None:
+                nonlocal response
+                response = await handler(request)
+                # only complete successful bodies are stored, streaming and error responses are passed through
+                if response.status_code != 200 or not hasattr(response, "body") or response.background is not None:
+                    return None
+                etag = response.headers.get("etag")
+                if etag is None:
+                    etag = f'"{hashlib.blake2b(response.body, digest_size=16).hexdigest()}"'
+                    response.headers["etag"] = etag
+                return CachedResponse(response.status_code, list(response.raw_headers), response.body, etag)
+
+            # concurrent misses of the same key wait for single handler call
+            cached = await cache.get_or_compute(key, compute, ttl=self.cache_ttl)
+            if cached is None:
+                cache.delete(key)
+                # response can be sent once, so requests coalesced on uncacheable one call handler on their own
+                return response if response is not None else await handler(request)
+            if etag_matches(request, cached.etag):
+                return _not_modified(cached)
+            return _replay(cached)
+
+        return cached_handler
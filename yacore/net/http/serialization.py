@@ -0,0 +1,89 @@
+import json
+import math
+from collections.abc import Callable
+from typing import Any
+
+from yacore.net.http.headers import parse_quality_values
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+def _finite(value: Any, default: Callable[[Any], Any] | None) -> Any:
+    # nan and infinity are written as null, like orjson does
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite(item, default) for key, item in value.items()}
+    if isinstance(value, list | tuple):
+        return [_finite(item, default) for item in value]
+    if value is None or isinstance(value, str | int) or default is None:
+        return value
+    return _finite(default(value), default)
+
+
+def _stdlib_json_dumps(value: Any, default: Callable[[Any], Any] | None = None) -> bytes:
+    options = dict(ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=default)
+    try:
+        return json.dumps(value, **options).encode()
+    except ValueError:
+        return json.dumps(_finite(value, default), **options).encode()
+
+
+def json_dumps(value: Any, default: Callable[[Any], Any] | None = None) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, default=default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # e.g. integers over 64 bits
+            pass
+    return _stdlib_json_dumps(value, default)
+
+
+def json_loads(data: bytes | str) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def msgpack_dumps(value: Any, default: Callable[[Any], Any] | None = None) -> bytes:
+    if msgpack is None:
+        raise RuntimeError("'msgpack' content format requires 'msgpack' package")
+    return msgpack.packb(value, default=default)
+
+
+def msgpack_loads(data: bytes) -> Any:
+    if msgpack is None:
+        raise RuntimeError("'msgpack' content format requires 'msgpack' package")
+    return msgpack.unpackb(data)
+
+
+CONTENT_FORMATS = {
+    "json": ("application/json", json_dumps, json_loads),
+    "msgpack": ("application/msgpack", msgpack_dumps, msgpack_loads),
+}
+MEDIA_TYPE_FORMATS = {
+    "application/json": "json",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+}
+
+
+def media_type_format(content_type: str) -> str | None:
+    return MEDIA_TYPE_FORMATS.get(content_type.partition(";")[0].strip().lower())
+
+
+def negotiate_format(accept: str, formats) -> str:
+    # json is used when client accepts none of enabled formats
+    best, best_weight = "json", 0.0
+    for media_type, weight in parse_quality_values(accept).items():
+        format = MEDIA_TYPE_FORMATS.get(media_type)
+        if format in formats and weight > best_weight:
+            best, best_weight = format, weight
+    return best
@@ -1,17 +1,29 @@
 import asyncio
-from typing import Any
+import functools
+from collections.abc import Callable, Hashable
 
 from cock import Option, build_options_from_dict
 from facet import ServiceMixin
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
 from hypercorn.asyncio import serve
 from hypercorn.config import Config
 from pydantic import BaseModel
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.requests import Request
+from starlette.responses import Response
 
-from yacore.injector import inject, register
+from yacore.cache import AsyncCache
+from yacore.injector import inject, injector, register
+from yacore.metrics import MetricsSink
+from yacore.net.http.compression import CompressionMiddleware, parse_compression_levels
+from yacore.net.http.limits import ConcurrencyLimiter, ConcurrencyLimitMiddleware
+from yacore.net.http.middleware import MetricsMiddleware
+from yacore.net.http.responses import NegotiatedResponse, api_error
+from yacore.net.http.routes import NetHttpRoute
+from yacore.net.http.serialization import CONTENT_FORMATS
+from yacore.net.http.streaming import STREAM_CHUNK_SIZE, stream_endpoint
+from yacore.net.http.workers import bind_socket, inherited_socket_fd
 
 ACCESS_LOG_DEFAULT_FORMAT = '%(h)s %(l)s %(l)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"'
 
@@ -23,7 +35,41 @@ net_http_options = build_options_from_dict({
         "healthcheck_name": Option(default="noname"),
         "access_log_format": Option(default=ACCESS_LOG_DEFAULT_FORMAT),
         "hide_methods_description_route": Option(default=False, type=bool),
+        # protocol and connection tuning, see hypercorn docs for details
+        "http2": Option(default=True, type=bool),
+        "certfile": Option(default=None),
+        "keyfile": Option(default=None),
+        # udp address for http/3, e.g. "0.0.0.0:443", requires tls and `aioquic`
+        "quic_bind": Option(default=None),
+        "keep_alive_timeout": Option(default=5.0, type=float),
+        "keep_alive_max_requests": Option(default=1000, type=int),
+        "backlog": Option(default=100, type=int),
+        "h2_max_concurrent_streams": Option(default=100, type=int),
+        # request and response body formats negotiated via content-type and accept headers, e.g. "msgpack"
+        "content_formats": Option(default=("json",), multiple=True),
+        # per route latency, status and size metrics, served in prometheus text format
+        "enable_metrics": Option(default=False, type=bool),
+        "metrics_route": Option(default="/metrics"),
         "build_info": Option(default="noinfo"),
+        # number of worker processes sharing listening socket, see `run_workers_from_config`
+        "workers": Option(default=1, type=int),
+        # every worker binds its own socket with SO_REUSEPORT instead of inheriting one from supervisor
+        "reuse_port": Option(default=False, type=bool),
+        # max number of responses kept by routes with `cache_ttl`
+        "response_cache_size": Option(default=1024, type=int),
+        # max number of requests handled at once, others wait in bounded queue or rejected with 503
+        "concurrency_limit": Option(default=None, type=int),
+        "concurrency_max_queue": Option(default=0, type=int),
+        "concurrency_queue_timeout": Option(default=None, type=float),
+        "concurrency_retry_after": Option(default=1, type=int),
+        # negotiated response compression, encodings are listed in server preference order
+        "compression": Option(default=False, type=bool),
+        "compression_encodings": Option(default=("zstd", "br", "gzip"), multiple=True),
+        "compression_min_size": Option(default=1024, type=int),
+        # "content/type:encoding:level", e.g. "application/json:br:5"
+        "compression_levels": Option(default=(), multiple=True),
+        # bodies of this size and bigger are compressed on `executors` cpu pool
+        "compression_offload_size": Option(default=None, type=int),
     },
 })
 
@@ -35,22 +81,18 @@ class HealthCheck(BaseModel):
     build_info: str
 
 
-def _api_error(status_code: int, code: str, message: str | None = None, data: Any | None = None):
-    return JSONResponse(
-        status_code=status_code,
-        content={
-            "code": code,
-            "message": message,
-            "data": data,
-        },
-    )
-
-
 class NetHttpServer(ServiceMixin):
 
     def __init__(self, host=None, port=80, *, enable_healthcheck=False, healthcheck_name="noname", version="unknown",
                  build_info="noinfo", access_log_format=ACCESS_LOG_DEFAULT_FORMAT,
-                 hide_methods_description_route=False):
+                 hide_methods_description_route=False, reuse_port=False, default_response_class=NegotiatedResponse,
+                 response_cache_size=1024, enable_metrics=False, metrics_route="/metrics",
+                 metrics: MetricsSink | None = None, concurrency_limit=None, concurrency_max_queue=0,
+                 concurrency_queue_timeout=None, concurrency_retry_after=1, compression=False,
+                 compression_encodings=("zstd", "br", "gzip"), compression_min_size=1024,
+                 compression_levels: dict[str, dict[str, int]] | None = None, compression_offload_size=None,
+                 executors=None, http2=True, certfile=None, keyfile=None, quic_bind=None, keep_alive_timeout=5.0,
+                 keep_alive_max_requests=1000, backlog=100, h2_max_concurrent_streams=100, content_formats=("json",)):
         self.host = host
         self.port = port
         self.enable_healthcheck = enable_healthcheck
@@ -66,52 +108,150 @@ class NetHttpServer(ServiceMixin):
             bind=f"{host}:{port}",
             access_log_format=access_log_format,
             graceful_timeout=0,
+            # h2c (prior knowledge and upgrade) is always served on plain connections,
+            # `http2` controls protocols offered via tls alpn
+            alpn_protocols=["h2", "http/1.1"] if http2 else ["http/1.1"],
+            certfile=certfile,
+            keyfile=keyfile,
+            quic_bind=[quic_bind] if quic_bind else [],
+            keep_alive_timeout=keep_alive_timeout,
+            keep_alive_max_requests=keep_alive_max_requests,
+            backlog=backlog,
+            h2_max_concurrent_streams=h2_max_concurrent_streams,
         )
         self.hide_methods_description_route = hide_methods_description_route
+        self.reuse_port = reuse_port
+        self.default_response_class = default_response_class
+        unknown = set(content_formats) - set(CONTENT_FORMATS)
+        if unknown:
+            raise ValueError(f"Unknown content formats {sorted(unknown)}, expect some of {list(CONTENT_FORMATS)}")
+        self.content_formats = tuple(content_formats)
+        self.response_cache = AsyncCache(maxsize=response_cache_size)
+        self.enable_metrics = enable_metrics
+        self.metrics_route = metrics_route
+        self.metrics = metrics or MetricsSink()
+        self.compression = compression
+        self.compression_encodings = compression_encodings
+        self.compression_min_size = compression_min_size
+        self.compression_levels = compression_levels
+        self.compression_offload_size = compression_offload_size
+        self.executors = executors
+        self.concurrency_limiter = None
+        if concurrency_limit is not None:
+            self.concurrency_limiter = ConcurrencyLimiter(
+                concurrency_limit,
+                max_queue=concurrency_max_queue,
+                queue_timeout=concurrency_queue_timeout,
+                retry_after=concurrency_retry_after,
+                metrics=self.metrics,
+            )
+
+    def _configure_bind(self):
+        bind = f"{self.host}:{self.port}"
+        fd = inherited_socket_fd(bind)
+        if fd is None and self.reuse_port:
+            fd = bind_socket(self.host, self.port, reuse_port=True, backlog=self.hypercorn_config.backlog).detach()
+        if fd is not None:
+            self.hypercorn_config.bind = [f"fd://{fd}"]
 
     async def start(self):
         # if someone want to customize app creation via subclass
         if self.app is None:
             if self.hide_methods_description_route:
-                self.app = FastAPI(openapi_url=None, docs_url=None, redoc_url=None)
+                self.app = FastAPI(openapi_url=None, docs_url=None, redoc_url=None,
+                                   default_response_class=self.default_response_class)
             else:
-                self.app = FastAPI()
+                self.app = FastAPI(default_response_class=self.default_response_class)
         self.app.add_exception_handler(Exception, self.error_handler)
         self.app.add_exception_handler(StarletteHTTPException, self.exception_handler)
         self.app.add_exception_handler(RequestValidationError, self.validation_handler)
         if self.enable_healthcheck:
             self.add_get("/healthcheck", self.get_healthcheck)
+        if self.compression:
+            self.app.add_middleware(
+                CompressionMiddleware,
+                encodings=self.compression_encodings,
+                min_size=self.compression_min_size,
+                levels=self.compression_levels,
+                executors=self.executors,
+                offload_size=self.compression_offload_size,
+            )
+        if self.concurrency_limiter is not None:
+            # service routes must answer even when server is overloaded
+            exempt_paths = ["/healthcheck", self.metrics_route]
+            self.app.add_middleware(ConcurrencyLimitMiddleware, limiter=self.concurrency_limiter,
+                                    exempt_paths=exempt_paths)
+        # added last to be outermost and see shed requests as well
+        if self.enable_metrics:
+            self.app.add_middleware(MetricsMiddleware, metrics=self.metrics)
+            if hasattr(self.metrics, "render"):
+                self.add_get(self.metrics_route, self.get_metrics, include_in_schema=False)
+        self._configure_bind()
         self.add_task(serve(
             self.app,
             self.hypercorn_config,
             shutdown_trigger=asyncio.Future,  # no signal handling
         ))
 
-    def add_route(self, *args, **kwargs):
-        self.app.add_api_route(*args, **kwargs)
+    def add_route(self, path, *args, route_class=NetHttpRoute, route_options: dict | None = None,
+                  concurrency_limit: int | None = None, concurrency_max_queue=0, concurrency_queue_timeout=None,
+                  concurrency_retry_after=1, **kwargs):
+        route_options = dict(route_options or {})
+        if set(self.content_formats) != {"json"}:
+            route_options["content_formats"] = self.content_formats
+        if concurrency_limit is not None:
+            route_options["concurrency_limiter"] = ConcurrencyLimiter(
+                concurrency_limit,
+                max_queue=concurrency_max_queue,
+                queue_timeout=concurrency_queue_timeout,
+                name=path,
+                status_code=429,
+                retry_after=concurrency_retry_after,
+                metrics=self.metrics,
+            )
+        if route_options:
+            route_class = functools.partial(route_class, **route_options)
+        self.app.router.add_api_route(path, *args, route_class_override=route_class, **kwargs)
 
-    def add_get(self, *args, **kwargs):
+    def add_get(self, *args, cache_ttl: float | None = None, cache_key: Callable[[Request], Hashable] | None = None,
+                **kwargs):
+        if cache_ttl is not None:
+            kwargs["route_options"] = dict(
+                response_cache=self.response_cache,
+                cache_ttl=cache_ttl,
+                cache_key=cache_key,
+            )
+        elif cache_key is not None:
+            raise ValueError("'cache_key' requires 'cache_ttl'")
         self.add_route(*args, methods=["get"], **kwargs)
 
+    def add_stream_get(self, path, handler, *, format="ndjson", chunk_size=STREAM_CHUNK_SIZE, csv_header=None,
+                       **kwargs):
+        # handler is an async generator function, its items are encoded as "ndjson", "json" array or "csv" rows
+        if kwargs.get("cache_ttl") is not None:
+            raise ValueError("Stream routes can't use response cache")
+        endpoint = stream_endpoint(handler, format, chunk_size=chunk_size, csv_header=csv_header)
+        self.add_get(path, endpoint, **kwargs)
+
     def add_post(self, *args, **kwargs):
         self.add_route(*args, methods=["post"], **kwargs)
 
     async def error_handler(self, request, exc: Exception):
-        return _api_error(
+        return api_error(
             status_code=500,
             code="common.internal_server_error",
             message="Internal server error",
         )
 
     async def exception_handler(self, request, exc: StarletteHTTPException):
-        return _api_error(
+        return api_error(
             status_code=exc.status_code,
             code="common.http_error",
             message=exc.detail,
         )
 
     async def validation_handler(self, request, exc: RequestValidationError):
-        return _api_error(
+        return api_error(
             status_code=422,
             code="common.validation_error",
             message=str(exc),
@@ -121,10 +261,13 @@ class NetHttpServer(ServiceMixin):
     async def get_healthcheck(self) -> HealthCheck:
         return self.healthcheck
 
+    async def get_metrics(self):
+        return Response(self.metrics.render(), media_type=self.metrics.content_type)
+
 
 @register(name="net_http_server", singleton=True)
 @inject
-def net_http_server_from_config(config, version):
+def net_http_server_from_config(config, version, metrics):
     return NetHttpServer(
         host=config.net_http_host,
         port=config.net_http_port,
@@ -134,4 +277,29 @@ def net_http_server_from_config(config, version):
         build_info=config.net_http_build_info,
         access_log_format=config.net_http_access_log_format,
         hide_methods_description_route=config.net_http_hide_methods_description_route,
+        reuse_port=config.net_http_reuse_port,
+        response_cache_size=config.net_http_response_cache_size,
+        enable_metrics=config.net_http_enable_metrics,
+        metrics_route=config.net_http_metrics_route,
+        metrics=metrics,
+        concurrency_limit=config.net_http_concurrency_limit,
+        concurrency_max_queue=config.net_http_concurrency_max_queue,
+        concurrency_queue_timeout=config.net_http_concurrency_queue_timeout,
+        concurrency_retry_after=config.net_http_concurrency_retry_after,
+        compression=config.net_http_compression,
+        compression_encodings=config.net_http_compression_encodings,
+        compression_min_size=config.net_http_compression_min_size,
+        compression_levels=parse_compression_levels(config.net_http_compression_levels),
+        compression_offload_size=config.net_http_compression_offload_size,
+        # executors service is expected to be started by application
+        executors=injector.get("executors") if config.net_http_compression_offload_size is not None else None,
+        http2=config.net_http_http2,
+        certfile=config.net_http_certfile,
+        keyfile=config.net_http_keyfile,
+        quic_bind=config.net_http_quic_bind,
+        keep_alive_timeout=config.net_http_keep_alive_timeout,
+        keep_alive_max_requests=config.net_http_keep_alive_max_requests,
+        backlog=config.net_http_backlog,
+        h2_max_concurrent_streams=config.net_http_h2_max_concurrent_streams,
+        content_formats=config.net_http_content_formats,
     )
@@ -0,0 +1,246 @@
+import codecs
+import contextlib
+import csv
+import functools
+import inspect
+import io
+import json
+import re
+from collections.abc import AsyncIterable, AsyncIterator, Callable, Sequence
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import StreamingResponse
+
+from yacore.net.http.serialization import json_dumps, json_loads
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _json(item) -> bytes:
+    return json_dumps(item, default=jsonable_encoder)
+
+
+async def encode_ndjson(items: AsyncIterable) -> AsyncIterator[bytes]:
+    async for item in items:
+        yield _json(item) + b"\n"
+
+
+async def encode_json_array(items: AsyncIterable) -> AsyncIterator[bytes]:
+    separator = b"["
+    async for item in items:
+        yield separator + _json(item)
+        separator = b","
+    yield b"[]" if separator == b"[" else b"]"
+
+
+async def encode_csv(items: AsyncIterable, header: Sequence[str] | None = None) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def row(values) -> bytes:
+        writer.writerow(values)
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    fields = header
+    if fields is not None:
+        yield row(fields)
+    async for item in items:
+        if isinstance(item, dict):
+            if fields is None:
+                fields = list(item)
+                yield row(fields)
+            item = [item.get(field) for field in fields]
+        yield row(item)
+
+
+STREAM_FORMATS = {
+    "ndjson": (encode_ndjson, "application/x-ndjson"),
+    "json": (encode_json_array, "application/json"),
+    "csv": (encode_csv, "text/csv; charset=utf-8"),
+}
+
+
+class ClosingStreamingResponse(StreamingResponse):
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # on client disconnect starlette stops iteration, but leaves generator suspended
+            # until garbage collection, so db cursors and other resources would be held
+            await self.body_iterator.aclose()
+
+
+async def _chunked(items: AsyncIterable, encode: Callable[[AsyncIterable], AsyncIterator[bytes]],
+                   chunk_size: int) -> AsyncIterator[bytes]:
+    async with contextlib.aclosing(items) if hasattr(items, "aclose") else contextlib.nullcontext():
+        buffer = bytearray()
+        async for data in encode(items):
+            buffer += data
+            # many small writes are coalesced, each send waits for transport to drain
+            if len(buffer) >= chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+
+
+def _stream_format(format: str):
+    if format not in STREAM_FORMATS:
+        raise ValueError(f"Unknown stream format {format!r}, expect one of {list(STREAM_FORMATS)}")
+    return STREAM_FORMATS[format]
+
+
+def encode_stream(items: AsyncIterable, format: str = "ndjson", *, chunk_size: int = STREAM_CHUNK_SIZE,
+                  csv_header: Sequence[str] | None = None) -> tuple[AsyncIterator[bytes], str]:
+    encode, media_type = _stream_format(format)
+    if format == "csv":
+        encode = functools.partial(encode, header=csv_header)
+    return _chunked(items, encode, chunk_size), media_type
+
+
+def stream_response(items: AsyncIterable, format: str = "ndjson", *, chunk_size: int = STREAM_CHUNK_SIZE,
+                    csv_header: Sequence[str] | None = None, **kwargs) -> ClosingStreamingResponse:
+    body, media_type = encode_stream(items, format, chunk_size=chunk_size, csv_header=csv_header)
+    return ClosingStreamingResponse(body, media_type=media_type, **kwargs)
+
+
+def stream_endpoint(handler: Callable[..., AsyncIterable], format: str = "ndjson", **options):
+    _stream_format(format)
+
+    async def endpoint(*args, **kwargs):
+        return stream_response(handler(*args, **kwargs), format, **options)
+
+    # handler signature is used for request parsing, but it is not exposed via `__wrapped__`,
+    # since fastapi handles async generator endpoints on its own
+    signature = inspect.signature(handler, eval_str=True)
+    endpoint.__signature__ = signature.replace(return_annotation=ClosingStreamingResponse)
+    endpoint.__name__ = handler.__name__
+    endpoint.__qualname__ = handler.__qualname__
+    endpoint.__doc__ = handler.__doc__
+    return endpoint
+
+
+async def decode_ndjson(chunks: AsyncIterable[bytes]) -> AsyncIterator:
+    buffer = b""
+    async for chunk in chunks:
+        *lines, buffer = (buffer + chunk).split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield json_loads(line)
+    if buffer.strip():
+        yield json_loads(buffer)
+
+
+_json_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\r\n]*")
+_string_special = re.compile(r'["\\]')
+# item boundary at top level is a delimiter, nested items are only tracked by brackets
+_top_level_special = re.compile(r'["\[\]{}, \t\r\n]')
+_nested_special = re.compile(r'["\[\]{}]')
+
+
+async def decode_json_array(chunks: AsyncIterable[bytes]) -> AsyncIterator:
+    # items are decoded as soon as they are received, only unparsed tail of array is kept in memory
+    # item end is found by scanning brackets from where previous chunk stopped, so large items are scanned once
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = None
+    scan = depth = 0
+    in_string = in_item = False
+    # between items: "first" item or end of array, "value" after comma or "delimiter" after item
+    expect = "first"
+    async for chunk in chunks:
+        buffer += text.decode(chunk)
+        if position is None:
+            stripped = buffer.lstrip()
+            if not stripped:
+                continue
+            if stripped[0] != "[":
+                raise ValueError("Expect json array")
+            buffer, position = stripped, 1
+        while True:
+            if not in_item:
+                position = _whitespace.match(buffer, position).end()
+                if position == len(buffer):
+                    break
+                char = buffer[position]
+                if expect == "delimiter":
+                    if char == "]":
+                        return
+                    if char != ",":
+                        raise json.JSONDecodeError("Expecting ',' delimiter", buffer, position)
+                    position += 1
+                    expect = "value"
+                    continue
+                if char == "]" and expect == "first":
+                    return
+                if char in ",]":
+                    raise json.JSONDecodeError("Expecting value", buffer, position)
+                in_item = True
+                scan = position
+            end = None
+            while end is None:
+                if in_string:
+                    match = _string_special.search(buffer, scan)
+                    if match is None or match.end() == len(buffer):
+                        # escaped character is not received yet
+                        scan = len(buffer) if match is None else match.start()
+                        break
+                    if match.group() == "\\":
+                        scan = match.end() + 1
+                        continue
+                    in_string = False
+                    scan = match.end()
+                    if depth == 0:
+                        end = scan
+                    continue
+                match = (_nested_special if depth else _top_level_special).search(buffer, scan)
+                if match is None:
+                    # number or literal at the end of buffer may be truncated, e.g. "2." of "2.5"
+                    scan = len(buffer)
+                    break
+                char = match.group()
+                scan = match.end()
+                if char == '"':
+                    in_string = True
+                elif char in "[{":
+                    depth += 1
+                elif depth == 0:
+                    end = scan = match.start()
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        end = scan
+            if end is None:
+                break
+            # item is complete, so decode error is an actual syntax error
+            item, decoded = _json_decoder.raw_decode(buffer, position)
+            if decoded != end:
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, decoded)
+            position = end
+            in_item = False
+            expect = "delimiter"
+            yield item
+        buffer, scan, position = buffer[position:], scan - position, 0
+    if in_item:
+        # raises actual syntax error, if it is not just a truncated array
+        _json_decoder.raw_decode(buffer, position)
+    raise ValueError("Unexpected end of json array")
+
+
+STREAM_DECODERS = {
+    "ndjson": decode_ndjson,
+    "json": decode_json_array,
+}
+
+
+def media_type_stream_format(content_type: str) -> str | None:
+    media_type = content_type.partition(";")[0].strip().lower()
+    for format, (_, format_media_type) in STREAM_FORMATS.items():
+        if format in STREAM_DECODERS and format_media_type == media_type:
+            return format
+    return None
@@ -0,0 +1,129 @@
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from collections.abc import Callable
+from multiprocessing.connection import wait
+from typing import Any
+
+from yacore.injector import inject
+
+SOCKETS_ENV = "YACORE_NET_HTTP_SOCKETS"
+
+logger = logging.getLogger(__name__)
+
+
+def bind_socket(host: str, port: int, *, reuse_port: bool = False, backlog: int = 100) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def inherited_socket_fd(bind: str) -> int | None:
+    for item in filter(None, os.environ.get(SOCKETS_ENV, "").split(",")):
+        address, _, fd = item.rpartition("=")
+        if address == bind:
+            return int(fd)
+    return None
+
+
+def _exit(*_):
+    raise SystemExit(0)
+
+
+def _run_worker(target: Callable[[], Any]):
+    # forked worker inherits supervisor signal handlers
+    signal.signal(signal.SIGTERM, _exit)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    target()
+
+
+class WorkersSupervisor:
+
+    def __init__(self, target: Callable[[], Any], workers: int, *, host: str, port: int, reuse_port: bool = False,
+                 backlog: int = 100, restart_delay: float = 1.0, stop_timeout: float = 10.0):
+        self.target = target
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port
+        self.backlog = backlog
+        self.restart_delay = restart_delay
+        self.stop_timeout = stop_timeout
+        self.processes: list[multiprocessing.Process] = []
+        self.restarts = 0
+        self._context = multiprocessing.get_context("fork")
+        self._stopping = threading.Event()
+
+    def _spawn(self) -> multiprocessing.Process:
+        process = self._context.Process(target=_run_worker, args=(self.target,))
+        process.start()
+        logger.info("Worker %d started", process.pid)
+        return process
+
+    def stop(self, *_):
+        self._stopping.set()
+
+    def _supervise(self):
+        self.processes = [self._spawn() for _ in range(self.workers)]
+        while not self._stopping.is_set():
+            wait([p.sentinel for p in self.processes], timeout=0.5)
+            for i, process in enumerate(self.processes):
+                if process.is_alive() or self._stopping.is_set():
+                    continue
+                logger.error("Worker %d exited with code %s, restarting", process.pid, process.exitcode)
+                # do not burn cpu on workers crashing right after start
+                self._stopping.wait(self.restart_delay)
+                if not self._stopping.is_set():
+                    self.processes[i] = self._spawn()
+                    self.restarts += 1
+
+    def _terminate(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.stop_timeout
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def run(self):
+        sock = None
+        if not self.reuse_port:
+            # workers inherit already listening socket and pick it up by address from environment
+            sock = bind_socket(self.host, self.port, backlog=self.backlog)
+            os.environ[SOCKETS_ENV] = f"{self.host}:{self.port}={sock.fileno()}"
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        try:
+            self._supervise()
+        finally:
+            self._terminate()
+            if sock is not None:
+                os.environ.pop(SOCKETS_ENV, None)
+                sock.close()
+
+
+@inject
+def run_workers_from_config(target: Callable[[], Any], config):
+    if config.net_http_workers <= 1:
+        return target()
+    WorkersSupervisor(
+        target,
+        config.net_http_workers,
+        host=config.net_http_host,
+        port=config.net_http_port,
+        reuse_port=config.net_http_reuse_port,
+        backlog=config.net_http_backlog,
+    ).run()